@@ -0,0 +1,117 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""Tests for inlining small assets and rebasing the URLs of the rest.
+
+Run from the project root with:
+
+    python -m unittest discover -s tests
+"""
+
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+
+from vulcanize.assets import AssetInliner
+from vulcanize.pipeline import build
+
+
+# Smallest valid GIF, small enough to always be inlined.
+SMALL_GIF = base64.b64decode(
+    'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+
+class AssetInlinerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.temp_dir, 'sub'))
+        self.write_file('sub/small.gif', SMALL_GIF)
+        self.write_file('sub/big.png', 'x' * 2000)
+        self.write_file(
+            'index.html',
+            '<!DOCTYPE html><html><head>'
+            '<link rel="import" href="sub/element.html">'
+            '</head><body><x-element></x-element></body></html>')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, relative_path, data):
+        path = os.path.join(self.temp_dir, *relative_path.split('/'))
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+    def build(self):
+        return build(self.temp_dir, os.path.join(self.temp_dir, 'index.html'),
+                     inline_assets=AssetInliner(1000)).output
+
+    def testRebase(self):
+        self.write_file(
+            'sub/element.html',
+            '<polymer-element name="x-element" noscript><template>'
+            '<style>.a { background: url(big.png); }</style>'
+            '<img src="big.png">'
+            '</template></polymer-element>')
+        output = self.build()
+        self.assertIn('url(sub/big.png)', output)
+        self.assertIn('src="sub/big.png"', output)
+
+    def testInlineDataUri(self):
+        self.write_file(
+            'sub/element.html',
+            '<polymer-element name="x-element" noscript><template>'
+            '<img src="small.gif">'
+            '</template></polymer-element>')
+        output = self.build()
+        self.assertIn(
+            'src="data:image/gif;base64,%s"' % base64.b64encode(SMALL_GIF),
+            output)
+        self.assertNotIn('small.gif', output)
+
+    def testKeepUnrewritableUrls(self):
+        self.write_file(
+            'sub/element.html',
+            '<polymer-element name="x-element" noscript><template>'
+            '<img src="{{src}}"><img src="http://example.com/a.png">'
+            '</template></polymer-element>')
+        output = self.build()
+        self.assertIn('src="{{src}}"', output)
+        self.assertIn('src="http://example.com/a.png"', output)
+
+    def testResourcesNestedInBodyRewrittenOnce(self):
+        self.write_file(
+            'sub/element.html',
+            '<div id="wrap">'
+            '<style>.a { background: url(big.png); }</style>'
+            '<polymer-element name="x-element" noscript><template>'
+            '<img src="big.png">'
+            '</template></polymer-element>'
+            '</div>'
+            '<p style="background: url(big.png)">Hello</p>')
+        output = self.build()
+        self.assertNotIn('sub/sub/', output)
+        self.assertIn('.a { background: url(sub/big.png); }', output)
+        self.assertIn('src="sub/big.png"', output)
+        self.assertIn('style="background: url(sub/big.png)"', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for fetching remote resources from a local stand-in HTTP server.
+
+Run from the project root with:
+
+    python -m unittest discover -s tests
+"""
+
+import BaseHTTPServer
+import SimpleHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from vulcanize import errors
+from vulcanize.fetcher import RemoteCache
+from vulcanize.pipeline import build
+
+
+class StandInHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Serves the server's files with ETags and records each request."""
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.get('If-None-Match')))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404, 'File not found')
+            return
+
+        etag = '"%x"' % (hash(content) & 0xffffffff)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), StandInHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.temp_dir)
+
+    def requested_paths(self):
+        return [path for path, _ in self.server.requests]
+
+
+class RemoteCacheTest(FetchTestBase):
+
+    def testFetch(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        fetch = RemoteCache(self.cache_dir)
+        path = fetch(self.base_url + '/lib.js')
+        with open(path) as handle:
+            self.assertEqual('var lib = 1;', handle.read())
+
+    def testMaxAge(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        fetch = RemoteCache(self.cache_dir)
+        fetch(self.base_url + '/lib.js')
+        fetch(self.base_url + '/lib.js')
+        self.assertEqual(['/lib.js'], self.requested_paths())
+
+    def testRevalidateNotModified(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        fetch = RemoteCache(self.cache_dir, max_age=0)
+        first_path = fetch(self.base_url + '/lib.js')
+        second_path = fetch(self.base_url + '/lib.js')
+        self.assertEqual(first_path, second_path)
+
+        (_, first_etag), (_, second_etag) = self.server.requests
+        self.assertIsNone(first_etag)
+        self.assertIsNotNone(second_etag)
+        with open(second_path) as handle:
+            self.assertEqual('var lib = 1;', handle.read())
+
+    def testRevalidateChanged(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        fetch = RemoteCache(self.cache_dir, max_age=0)
+        fetch(self.base_url + '/lib.js')
+        self.server.files['/lib.js'] = 'var lib = 2;'
+        path = fetch(self.base_url + '/lib.js')
+        with open(path) as handle:
+            self.assertEqual('var lib = 2;', handle.read())
+
+    def testNotFound(self):
+        fetch = RemoteCache(self.cache_dir)
+        self.assertRaises(errors.FetchError, fetch, self.base_url + '/no.js')
+
+    def testFallbackToCachedCopy(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        fetch = RemoteCache(self.cache_dir, max_age=0)
+        fetch(self.base_url + '/lib.js')
+        del self.server.files['/lib.js']
+        path = fetch(self.base_url + '/lib.js')
+        with open(path) as handle:
+            self.assertEqual('var lib = 1;', handle.read())
+
+    def testOffline(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        RemoteCache(self.cache_dir)(self.base_url + '/lib.js')
+
+        offline = RemoteCache(self.cache_dir, offline=True)
+        path = offline(self.base_url + '/lib.js')
+        with open(path) as handle:
+            self.assertEqual('var lib = 1;', handle.read())
+        self.assertRaises(
+            errors.FetchError, offline, self.base_url + '/other.js')
+        self.assertEqual(['/lib.js'], self.requested_paths())
+
+
+class BuildWithFetchTest(FetchTestBase):
+
+    def write_index(self, head):
+        path = os.path.join(self.temp_dir, 'index.html')
+        with open(path, 'w') as handle:
+            handle.write('<!DOCTYPE html><html><head>%s</head>'
+                         '<body></body></html>' % head)
+        return path
+
+    def testInlineRemoteResources(self):
+        self.server.files['/lib.js'] = 'var lib = 1;'
+        self.server.files['/style.css'] = 'body { color: red; }'
+        self.server.files['/element.html'] = (
+            '<script src="element.js"></script>')
+        self.server.files['/element.js'] = 'var element = 1;'
+        index_path = self.write_index(
+            '<script src="%(base)s/lib.js"></script>'
+            '<link rel="stylesheet" href="%(base)s/style.css">'
+            '<link rel="import" href="%(base)s/element.html">' %
+            {'base': self.base_url})
+
+        bundle = build(self.temp_dir, index_path,
+                       fetch=RemoteCache(self.cache_dir))
+        self.assertIn('var lib = 1;', bundle.output)
+        self.assertIn('body { color: red; }', bundle.output)
+        self.assertIn('var element = 1;', bundle.output)
+        self.assertNotIn('src="%s' % self.base_url, bundle.output)
+        self.assertNotIn('href="%s' % self.base_url, bundle.output)
+
+    def testOtherLinksNotFetched(self):
+        self.server.files['/style.css'] = 'body { color: red; }'
+        links = (
+            '<link rel="preconnect" href="%(base)s/nothing-here/">'
+            '<link rel="canonical" href="%(base)s/page">'
+            '<link rel="icon" href="%(base)s/favicon.ico">'
+            '<link rel="alternate" href="%(base)s/feed.xml">' %
+            {'base': self.base_url})
+        index_path = self.write_index(
+            links +
+            '<link rel="stylesheet" href="%s/style.css">' % self.base_url)
+
+        bundle = build(self.temp_dir, index_path,
+                       fetch=RemoteCache(self.cache_dir))
+        self.assertEqual(['/style.css'], self.requested_paths())
+        self.assertIn('body { color: red; }', bundle.output)
+        for url in ('/nothing-here/', '/page', '/favicon.ico', '/feed.xml'):
+            self.assertIn('href="%s%s"' % (self.base_url, url), bundle.output)
+
+    def testOtherLinksOffline(self):
+        index_path = self.write_index(
+            '<link rel="preconnect" href="%s/nothing-here/">' %
+            self.base_url)
+        bundle = build(self.temp_dir, index_path,
+                       fetch=RemoteCache(self.cache_dir, offline=True))
+        self.assertIn(self.base_url + '/nothing-here/', bundle.output)
+        self.assertEqual([], self.requested_paths())
+
+
+if __name__ == '__main__':
+    unittest.main()
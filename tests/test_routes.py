@@ -0,0 +1,119 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""Tests for building lazy per-route bundles.
+
+Run from the project root with:
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vulcanize.assembler import Route
+from vulcanize.pipeline import build
+
+
+class RoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.temp_dir, 'views'))
+        self.write_file(
+            'index.html',
+            '<!DOCTYPE html><html><head></head>'
+            '<body><p>Home</p></body></html>')
+        self.write_file(
+            'views/shared.html',
+            '<polymer-element name="x-shared" noscript>'
+            '<template>Shared</template></polymer-element>')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, relative_path, data):
+        path = os.path.join(self.temp_dir, *relative_path.split('/'))
+        with open(path, 'w') as handle:
+            handle.write(data)
+
+    def build(self, routes):
+        return build(self.temp_dir, os.path.join(self.temp_dir, 'index.html'),
+                     routes=routes)
+
+    def testBodyContent(self):
+        self.write_file(
+            'views/settings.html',
+            '<div class="note">Hello</div>'
+            '<polymer-element name="x-settings" noscript>'
+            '<template>Settings</template></polymer-element>')
+        bundle = self.build(
+            [Route('settings', 'o.settings.html', ['views/settings.html'])])
+        output = bundle.extra_outputs['o.settings.html']
+        self.assertIn('<div class="note">Hello</div>', output)
+        self.assertIn('<polymer-element name="x-settings">', output)
+        self.assertNotIn('Hello', bundle.output)
+
+    def testSharedImportInMainOutput(self):
+        self.write_file(
+            'views/settings.html',
+            '<link rel="import" href="shared.html">'
+            '<polymer-element name="x-settings" noscript>'
+            '<template>Settings</template></polymer-element>')
+        self.write_file(
+            'views/admin.html',
+            '<link rel="import" href="shared.html">'
+            '<polymer-element name="x-admin" noscript>'
+            '<template>Admin</template></polymer-element>')
+        bundle = self.build([
+            Route('settings', 'o.settings.html', ['views/settings.html']),
+            Route('admin', 'o.admin.html', ['views/admin.html']),
+        ])
+
+        self.assertEqual(1, bundle.output.count('name="x-shared"'))
+        self.assertEqual(1, bundle.output.count("Polymer('x-shared')"))
+        settings = bundle.extra_outputs['o.settings.html']
+        admin = bundle.extra_outputs['o.admin.html']
+        for output in (settings, admin):
+            self.assertNotIn('x-shared', output)
+        self.assertIn('name="x-settings"', settings)
+        self.assertIn('name="x-admin"', admin)
+
+    def testImportOfOneRouteStaysInItsBundle(self):
+        self.write_file(
+            'views/settings.html',
+            '<link rel="import" href="shared.html">')
+        self.write_file(
+            'views/admin.html',
+            '<polymer-element name="x-admin" noscript>'
+            '<template>Admin</template></polymer-element>')
+        bundle = self.build([
+            Route('settings', 'o.settings.html', ['views/settings.html']),
+            Route('admin', 'o.admin.html', ['views/admin.html']),
+        ])
+
+        self.assertNotIn('x-shared', bundle.output)
+        self.assertIn('name="x-shared"',
+                      bundle.extra_outputs['o.settings.html'])
+        self.assertNotIn('x-shared', bundle.extra_outputs['o.admin.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
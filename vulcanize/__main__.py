@@ -20,14 +20,27 @@ The current working directory will be used as the vulcanizing root.
 """
 
 import argparse
+import json
 import logging
 import os
+import re
 import sys
 
-from . pipeline import vulcanize
+from . assembler import Route
+from . assets import AssetInliner
+from . compress import DEFAULT_LEVEL, compress_files
+from . fetcher import DEFAULT_CACHE_DIR, RemoteCache
+from . pipeline import build
 from . server import run_server
 
 
+# Route names are used in the file names of their bundles.
+ROUTE_NAME_RE = re.compile(r'^[\w-]+$')
+
+# Suffixes of other files written next to the output.
+RESERVED_ROUTE_NAMES = ('deferred', 'links', 'routes')
+
+
 class Flags(object):
 
     def __init__(self):
@@ -56,6 +69,108 @@ class Flags(object):
             action='store',
             type=int,
             default=0)
+        self.parser.add_argument(
+            '--cache-mb',
+            help='Memory budget in megabytes for the server to keep built '
+                 'files and parsed imports between requests.',
+            action='store',
+            type=int,
+            default=32)
+        self.parser.add_argument(
+            '--prewarm',
+            help='Path to another file for the server to vulcanize at '
+                 'startup and rebuild as soon as its files change. May be '
+                 'given more than once.',
+            action='append',
+            default=[])
+        self.parser.add_argument(
+            '--wait-for-rebuild',
+            help='Make server requests wait for an in-flight rebuild instead '
+                 'of returning the last good output right away.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--fetch',
+            help='Fetch remote scripts, stylesheets and imports so they can '
+                 'be inlined.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--fetch-cache',
+            help='Directory to keep fetched remote resources in.',
+            action='store',
+            type=str,
+            default=DEFAULT_CACHE_DIR)
+        self.parser.add_argument(
+            '--offline',
+            help='Only use remote resources that were already fetched '
+                 'into the fetch cache.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--doc-root',
+            help='Directory that root-absolute URLs like /foo/bar.html are '
+                 'served from, so they can be inlined.',
+            action='store',
+            type=str,
+            default=None)
+        self.parser.add_argument(
+            '--split',
+            help='Move the polymer-elements that aren\'t needed for first '
+                 'paint into a separate import that is loaded '
+                 'asynchronously. Requires --output.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--critical',
+            help='Name of a polymer-element to keep in the main output when '
+                 'splitting. May be given more than once.',
+            action='append',
+            default=[])
+        self.parser.add_argument(
+            '--inline-assets',
+            help='Inline images and fonts referenced by imports that are '
+                 'at most this many bytes as data URIs, and rebase the URLs '
+                 'of larger ones.',
+            action='store',
+            type=int,
+            default=None)
+        self.parser.add_argument(
+            '--resource-hints',
+            help='Add preconnect and preload hints to the head for the '
+                 'scripts, stylesheets and imports that are left external. '
+                 'The server also sends them as Link headers.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--link-manifest',
+            help='With --resource-hints, also write a JSON file next to the '
+                 'output that maps its file name to the values of the Link '
+                 'headers to serve it with. Requires --output.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--compress',
+            help='Write gzip copies of each output file next to it, and '
+                 'brotli copies if the brotli module is installed, for '
+                 'static servers to send as-is. Requires --output.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--compress-level',
+            help='Compression level from 1 to 9 for --compress.',
+            action='store',
+            type=int,
+            default=DEFAULT_LEVEL)
+        self.parser.add_argument(
+            '-c', '--config',
+            help='Path to a JSON config file. Its "routes" object maps '
+                 'route names to lists of imports, relative to the index '
+                 'file, that get their own lazily loaded bundle. Requires '
+                 '--output.',
+            action='store',
+            type=str,
+            default=None)
         self.parser.add_argument(
             'index_path',
             help='Path to the index file to vulcanize.',
@@ -69,28 +184,150 @@ class Flags(object):
             self.parser.error('index_path required')
         if not os.path.isfile(self.index_path):
             self.parser.error('index_path %r does not exist' % self.index_path)
+        if self.doc_root and not os.path.isdir(self.doc_root):
+            self.parser.error('doc_root %r does not exist' % self.doc_root)
+        if self.split and not self.output:
+            self.parser.error('--split requires --output')
+        if self.link_manifest and not self.resource_hints:
+            self.parser.error('--link-manifest requires --resource-hints')
+        if self.link_manifest and not self.output:
+            self.parser.error('--link-manifest requires --output')
+        if self.compress and not self.output:
+            self.parser.error('--compress requires --output')
+        if not 1 <= self.compress_level <= 9:
+            self.parser.error('--compress-level must be from 1 to 9')
+
+        self.routes = {}
+        if self.config:
+            try:
+                with open(self.config) as handle:
+                    config = json.load(handle)
+            except (IOError, ValueError) as e:
+                self.parser.error('config %r is invalid: %s' % (self.config, e))
+            self.routes = config.get('routes', {})
+        if not isinstance(self.routes, dict):
+            self.parser.error('routes in --config must be an object')
+        for name, entry_urls in self.routes.iteritems():
+            if not ROUTE_NAME_RE.match(name) or name in RESERVED_ROUTE_NAMES:
+                self.parser.error('route name %r is invalid' % name)
+            if (not isinstance(entry_urls, list) or
+                    not all(isinstance(url, basestring) for url in entry_urls)):
+                self.parser.error(
+                    'route %r must be a list of import URLs' % name)
+        if self.routes and not self.output:
+            self.parser.error('routes in --config require --output')
 
 
 FLAGS = Flags()
 
 
+def get_sibling_url(output_path, suffix, ext=None):
+    """Returns the URL of a file next to the output with the given suffix."""
+    base, output_ext = os.path.splitext(os.path.basename(output_path))
+    return '%s.%s%s' % (base, suffix, ext or output_ext)
+
+
+def write_file(path, output):
+    """Writes the file unless it already has the same contents.
+
+    Leaving unchanged files alone keeps their modification times, so static
+    servers don't see them as changed.
+    """
+    try:
+        with open(path, 'rb') as handle:
+            if handle.read() == output:
+                return
+    except IOError:
+        pass
+    with open(path, 'wb') as handle:
+        handle.write(output)
+
+
+def write_outputs(bundle, output_path):
+    """Writes the bundle's output files.
+
+    Extra outputs are written relative to the directory of output_path.
+
+    Returns:
+        List of the paths of the output files.
+    """
+    written = [output_path]
+    write_file(output_path, bundle.output)
+
+    output_dir = os.path.dirname(output_path)
+    for url, output in bundle.extra_outputs.iteritems():
+        path = os.path.join(output_dir, *url.split('/'))
+        write_file(path, output)
+        written.append(path)
+
+    return written
+
+
+def write_link_manifest(bundle, output_path):
+    """Writes the Link header values of the output next to it as JSON.
+
+    Returns:
+        Path of the manifest.
+    """
+    path = os.path.join(os.path.dirname(output_path),
+                        get_sibling_url(output_path, 'links', ext='.json'))
+    manifest = {os.path.basename(output_path): bundle.links}
+    write_file(path, json.dumps(
+        manifest, indent=2, separators=(',', ': '), sort_keys=True))
+    return path
+
+
 def main():
     FLAGS.parse()
 
     if FLAGS.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    build_options = {
+        'doc_root': FLAGS.doc_root,
+        'resource_hints': FLAGS.resource_hints,
+    }
+    if FLAGS.fetch or FLAGS.offline:
+        build_options['fetch'] = RemoteCache(
+            FLAGS.fetch_cache, offline=FLAGS.offline)
+
+    if FLAGS.inline_assets is not None:
+        build_options['inline_assets'] = AssetInliner(FLAGS.inline_assets)
+
     if FLAGS.port:
-        run_server(FLAGS.host, FLAGS.port, os.getcwd(), FLAGS.index_path)
+        run_server(FLAGS.host, FLAGS.port, os.getcwd(), FLAGS.index_path,
+                   max_bytes=FLAGS.cache_mb * 1024 * 1024,
+                   prewarm_paths=FLAGS.prewarm,
+                   wait_for_rebuild=FLAGS.wait_for_rebuild,
+                   **build_options)
         return 0
 
-    result = vulcanize(os.getcwd(), FLAGS.index_path)
+    if FLAGS.split:
+        build_options['deferred_url'] = get_sibling_url(
+            FLAGS.output, 'deferred')
+        build_options['critical_elements'] = FLAGS.critical
+
+    if FLAGS.routes:
+        build_options['routes'] = [
+            Route(name, get_sibling_url(FLAGS.output, name), entry_urls)
+            for name, entry_urls in sorted(FLAGS.routes.iteritems())]
+        build_options['manifest_url'] = get_sibling_url(
+            FLAGS.output, 'routes', ext='.json')
+
+    bundle = build(os.getcwd(), FLAGS.index_path, **build_options)
 
     if FLAGS.output:
-        with open(FLAGS.output, 'wb') as handle:
-            handle.write(result)
+        written = write_outputs(bundle, FLAGS.output)
+        if FLAGS.link_manifest:
+            written.append(write_link_manifest(bundle, FLAGS.output))
+        if bundle.extra_outputs:
+            for path, (_, size) in zip(written, bundle.sizes()):
+                sys.stderr.write('%10d bytes  %s\n' % (size, path))
+        if FLAGS.compress:
+            for path in compress_files(written, level=FLAGS.compress_level):
+                logging.info('Wrote %s', path)
     else:
-        print result
+        print bundle.output
 
     return 0
 
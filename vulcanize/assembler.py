@@ -17,6 +17,7 @@
 from copy import deepcopy
 from cStringIO import StringIO
 import logging
+import urlparse
 
 from lxml import etree
 from lxml import html
@@ -27,8 +28,8 @@ from . import importer
 
 class FileIndex(object):
 
-    def __init__(self):
-        self.index = {}
+    def __init__(self, index=None):
+        self.index = dict(index or {})
 
     def add(self, relative_url, path):
         assert relative_url
@@ -42,9 +43,10 @@ class FileIndex(object):
 
 class Traverser(object):
 
-    def __init__(self, import_tag):
+    def __init__(self, import_tag, file_index=None):
         self.import_tag = import_tag
-        self.file_index = FileIndex()
+        self.file_index = file_index or FileIndex()
+        self.dependencies = set()
 
     def __call__(self, node):
         """Traverse all dependencies in the given node.
@@ -69,6 +71,11 @@ class Traverser(object):
                 remove_node(el)
                 continue
 
+            # Only files that went into the output can make it stale. Links
+            # like rel="icon" may point at files that don't exist.
+            self.dependencies.update(dep.read_paths)
+            self.dependencies.update(dep.asset_paths)
+
             if (dep.is_included_resource and
                     not self.file_index.add(dep.relative_url, dep.path)):
                 # Resource already included.
@@ -116,7 +123,202 @@ def copy_clean(el):
     return copied
 
 
-def assemble(root_file, traverse):
+def custom_element_names(el):
+    """Returns the names of the custom elements used within the given one."""
+    names = set()
+    for child_el in el.iter():
+        tag = child_el.tag
+        if (isinstance(tag, basestring) and '-' in tag and
+                tag != 'polymer-element'):
+            names.add(tag)
+    extends = el.attrib.get('extends', '')
+    if '-' in extends:
+        names.add(extends)
+    return names
+
+
+class ImportDocument(object):
+    """HTML import holding polymer-element definitions and their scripts."""
+
+    def __init__(self):
+        self.body_el = html.Element('body')
+        self.head_script = StringIO()
+        self.script = StringIO()
+
+    def add_element(self, el):
+        self.body_el.append(el)
+
+    def add_head_script(self, text):
+        """Adds script that must run before the elements are registered."""
+        self.head_script.write(text)
+        self.head_script.write('\n;\n')
+
+    def add_script(self, text):
+        self.script.write(text)
+        self.script.write('\n;\n')
+
+    def to_element(self):
+        root_el = html.Element('html')
+        root_el.append(html.Element('head'))
+        root_el.append(self.body_el)
+
+        head_script = self.head_script.getvalue()
+        if head_script:
+            head_script_el = html.Element(
+                'script', attrib={'type': 'text/javascript'})
+            head_script_el.text = head_script.decode('utf-8')
+            self.body_el.insert(0, head_script_el)
+
+        script_el = html.Element('script', attrib={'type': 'text/javascript'})
+        script_el.text = self.script.getvalue().decode('utf-8')
+        self.body_el.append(script_el)
+        return root_el
+
+
+class Route(object):
+    """Imports that are only needed once the app navigates to a view.
+
+    Args:
+        name: Name of the route.
+        url: URL of the route's bundle, relative to the main output.
+        entry_urls: URLs of the route's imports, relative to the index file.
+    """
+
+    def __init__(self, name, url, entry_urls):
+        self.name = name
+        self.url = url
+        self.entry_urls = entry_urls
+
+    def __repr__(self):
+        return 'Route(name=%r, url=%r)' % (self.name, self.url)
+
+
+class Split(object):
+    """Splits polymer-elements not needed for first paint into an import.
+
+    The elements used in the body of the root file are critical, along with
+    any elements those use or extend, and any named in critical_elements.
+    All other polymer-elements and their scripts go into a separate
+    document that the critical document imports asynchronously from
+    deferred_url.
+    """
+
+    def __init__(self, deferred_url, critical_elements=()):
+        self.deferred_url = deferred_url
+        self.critical_elements = set(critical_elements)
+        self.critical = set()
+        self.document = ImportDocument()
+
+    def find_critical_elements(self, root_file, tags):
+        definitions = {}
+        for tag in tags:
+            if isinstance(tag, importer.ImportedPolymerElement):
+                definitions[tag.el.attrib.get('name')] = tag.el
+
+        pending = set(self.critical_elements)
+        for el in root_file.body_tags:
+            pending.update(custom_element_names(el))
+
+        while pending:
+            name = pending.pop()
+            if name in self.critical:
+                continue
+            self.critical.add(name)
+            definition = definitions.get(name)
+            if definition is not None:
+                pending.update(custom_element_names(definition))
+
+        logging.debug('Critical elements: %r', sorted(self.critical))
+
+    def is_deferred(self, polymer_el):
+        return polymer_el.attrib.get('name') not in self.critical
+
+
+class ResourceHints(object):
+    """Preconnect and preload hints for the resources left external.
+
+    External scripts and stylesheets are preloaded and the origins of all
+    external resources are preconnected, so the browser can start on them
+    before it gets to the tags that load them.
+    """
+
+    # Values of the 'as' attribute of preloads for each kind of tag.
+    PRELOAD_TYPES = {
+        'script': 'script',
+        'stylesheet': 'style',
+    }
+
+    def __init__(self):
+        self.origins = []
+        # List of (url, 'as' value, crossorigin value or None).
+        self.preloads = []
+
+    def add(self, el):
+        """Adds hints for an external script or link tag."""
+        if el.tag == 'script':
+            url = el.attrib.get('src')
+            preload_type = self.PRELOAD_TYPES['script']
+        else:
+            url = el.attrib.get('href')
+            preload_type = self.PRELOAD_TYPES.get(el.attrib.get('rel'))
+        if not url:
+            return
+
+        parts = urlparse.urlsplit(url)
+        if parts.netloc:
+            origin = urlparse.urlunsplit(
+                (parts.scheme, parts.netloc, '', '', ''))
+            if origin not in self.origins:
+                self.origins.append(origin)
+
+        if preload_type is None:
+            return
+        preload = (url, preload_type, el.attrib.get('crossorigin'))
+        if preload not in self.preloads:
+            self.preloads.append(preload)
+
+    def to_elements(self):
+        """Returns link elements for the hints, in loading order."""
+        result = []
+        for origin in self.origins:
+            result.append(html.Element('link', attrib={
+                'rel': 'preconnect',
+                'href': origin,
+            }))
+        for url, preload_type, crossorigin in self.preloads:
+            attrib = {'rel': 'preload', 'href': url, 'as': preload_type}
+            if crossorigin is not None:
+                attrib['crossorigin'] = crossorigin
+            result.append(html.Element('link', attrib=attrib))
+        return result
+
+    def to_link_headers(self):
+        """Returns the value of an HTTP Link header for each hint."""
+        result = []
+        for origin in self.origins:
+            result.append('<%s>; rel=preconnect' % origin)
+        for url, preload_type, crossorigin in self.preloads:
+            value = '<%s>; rel=preload; as=%s' % (url, preload_type)
+            if crossorigin is not None:
+                value += '; crossorigin'
+            result.append(value)
+        return result
+
+
+def assemble(root_file, traverse, split=None, hints=None):
+    """Assembles the root file and its dependencies into one document.
+
+    Args:
+        root_file: ImportedHtml to assemble.
+        traverse: Traverser for the dependencies of the root file.
+        split: Optional Split that receives the polymer-elements that aren't
+            needed for first paint.
+        hints: Optional ResourceHints that collects the resources left
+            external. Its hints are put first in the head.
+
+    Returns:
+        Root element of the assembled document.
+    """
     root_el = html.Element('html', attrib=root_file.el.getroot().attrib)
 
     head_el = html.Element('head')
@@ -131,7 +333,11 @@ def assemble(root_file, traverse):
     combined_head_script = StringIO()
     combined_body_script = StringIO()
 
-    for tag in traverse(root_file):
+    tags = list(traverse(root_file))
+    if split is not None:
+        split.find_critical_elements(root_file, tags)
+
+    for tag in tags:
         logging.debug('Assembling %r', tag)
 
         if isinstance(tag, importer.ImportedLink):
@@ -152,6 +358,8 @@ def assemble(root_file, traverse):
                 copied = copy_clean(tag.el)
                 remove_node(tag.el)
                 head_el.append(copied)
+                if hints is not None:
+                    hints.add(copied)
         elif isinstance(tag, importer.ImportedStyle):
             # Move the style tag to the root if it's not part of a
             # polymer element.
@@ -162,7 +370,11 @@ def assemble(root_file, traverse):
         elif isinstance(tag, importer.ImportedScript):
             if not tag.is_included_resource:
                 remove_node(tag.el)
-                if tag.polymer_element_ancestor is not None:
+                if (split is not None and
+                        tag.polymer_element_ancestor is not None and
+                        split.is_deferred(tag.polymer_element_ancestor)):
+                    split.document.add_script(tag.text)
+                elif tag.polymer_element_ancestor is not None:
                     combined_body_script.write(tag.text)
                     combined_body_script.write('\n;\n')
                 else:
@@ -173,10 +385,15 @@ def assemble(root_file, traverse):
                 copied = copy_clean(tag.el)
                 remove_node(tag.el)
                 head_el.append(copied)
+                if hints is not None:
+                    hints.add(copied)
         elif isinstance(tag, importer.ImportedPolymerElement):
             copied = copy_clean(tag.el)
             remove_node(tag.el)
-            hidden_el.append(copied)
+            if split is not None and split.is_deferred(tag.el):
+                split.document.add_element(copied)
+            else:
+                hidden_el.append(copied)
         elif isinstance(tag, importer.ImportedHtml):
             for child_tag in tag.body_tags:
                 copied = copy_clean(child_tag)
@@ -199,8 +416,83 @@ def assemble(root_file, traverse):
     # as link tags.
     head_el.insert(0, head_script_el)
 
+    if hints is not None:
+        # Hints don't block anything, so they can go before the head script
+        # to get the connections and downloads started while it runs.
+        for el in reversed(hints.to_elements()):
+            head_el.insert(0, el)
+
     body_script_el = html.Element('script', attrib={'type': 'text/javascript'})
     body_script_el.text = combined_body_script.getvalue().decode('utf-8')
     body_el.append(body_script_el)
 
+    if split is not None:
+        # Load the rest of the elements without blocking first paint.
+        head_el.append(html.Element('link', attrib={
+            'rel': 'import',
+            'href': split.deferred_url,
+            'async': 'async',
+        }))
+
     return root_el
+
+
+def assemble_import(root_files, traverse):
+    """Assembles the given files and their dependencies into an import.
+
+    Resources that traverse has already seen are left out, so seeding its
+    file index with the files of another bundle makes this only contain
+    what that bundle doesn't.
+
+    Args:
+        root_files: List of ImportedHtml to assemble, in order.
+        traverse: Traverser for the dependencies of the root files.
+
+    Returns:
+        ImportDocument instance.
+    """
+    document = ImportDocument()
+
+    for root_file in root_files:
+        for tag in traverse(root_file):
+            logging.debug('Assembling %r', tag)
+
+            if isinstance(tag, importer.ImportedLink):
+                if (tag.replacement is not None and
+                        tag.polymer_element_ancestor is not None):
+                    tag.el.addprevious(tag.replacement)
+                    remove_node(tag.el)
+                elif tag.replacement is not None:
+                    remove_node(tag.el)
+                    document.add_element(tag.replacement)
+                else:
+                    copied = copy_clean(tag.el)
+                    remove_node(tag.el)
+                    document.add_element(copied)
+            elif isinstance(tag, importer.ImportedStyle):
+                if tag.polymer_element_ancestor is None:
+                    copied = copy_clean(tag.el)
+                    remove_node(tag.el)
+                    document.add_element(copied)
+            elif isinstance(tag, importer.ImportedScript):
+                if tag.is_included_resource:
+                    copied = copy_clean(tag.el)
+                    remove_node(tag.el)
+                    document.add_element(copied)
+                elif tag.polymer_element_ancestor is not None:
+                    remove_node(tag.el)
+                    document.add_script(tag.text)
+                else:
+                    remove_node(tag.el)
+                    document.add_head_script(tag.text)
+            elif isinstance(tag, importer.ImportedPolymerElement):
+                copied = copy_clean(tag.el)
+                remove_node(tag.el)
+                document.add_element(copied)
+            elif isinstance(tag, importer.ImportedHtml):
+                for child_tag in tag.body_tags:
+                    copied = copy_clean(child_tag)
+                    remove_node(child_tag)
+                    document.add_element(copied)
+
+    return document
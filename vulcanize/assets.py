@@ -0,0 +1,249 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Inlines small assets as data URIs and rebases the URLs of the rest."""
+
+import base64
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import urlparse
+
+from . import importer
+
+
+# Matches url() references in CSS.
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# Types that the mimetypes module doesn't know about everywhere.
+EXTRA_TYPES = {
+    '.svg': 'image/svg+xml',
+    '.woff': 'application/font-woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'application/font-sfnt',
+    '.otf': 'application/font-sfnt',
+    '.eot': 'application/vnd.ms-fontobject',
+}
+
+
+def get_content_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in EXTRA_TYPES:
+        return EXTRA_TYPES[ext]
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type or 'application/octet-stream'
+
+
+def is_rewritable(url):
+    """Returns True if the URL refers to a file that may be rewritten."""
+    url = url.strip()
+    if not url or url.startswith('#') or url.startswith('data:'):
+        return False
+    if '{{' in url or '[[' in url:
+        # Polymer template binding.
+        return False
+    if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', url) and not (
+            url.startswith('http://') or url.startswith('https://')):
+        # mailto:, javascript:, etc.
+        return False
+    return True
+
+
+# Tags that the Traverser imports on their own, wherever they appear.
+RESOURCE_TAGS = frozenset(['style', 'script', 'link', 'polymer-element'])
+
+
+def is_icon_link(el):
+    return 'icon' in el.attrib.get('rel', '').lower().split()
+
+
+def iter_elements(el, skip_tags=()):
+    """Yields the element and its descendants in document order.
+
+    Subtrees rooted at a tag in skip_tags are left out entirely.
+    """
+    if el.tag in skip_tags:
+        return
+    yield el
+    for child_el in el:
+        for descendant_el in iter_elements(child_el, skip_tags=skip_tags):
+            yield descendant_el
+
+
+class AssetInliner(object):
+    """Rewrites the URLs of assets referenced from inlined resources.
+
+    Assets up to max_bytes are inlined as base64 data URIs. Larger ones
+    are rebased to be relative to the index file, since the resources that
+    referred to them were moved into it. The encoded data URI of each file
+    is kept between builds until the file changes.
+
+    Thread-safe.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Map of file path to (mtime, size, data URI).
+        self.data_uris = {}
+
+    def rewrite(self, tag, parent_relative_url, resolve):
+        """Rewrites the asset URLs in the given imported tag in place.
+
+        Args:
+            tag: ImportedTag that was just parsed.
+            parent_relative_url: Relative URL of the file the tag is in.
+            resolve: PathResolver for the current build.
+
+        Returns:
+            List of the paths of the assets that were inlined.
+        """
+        rewriter = Rewriter(self, resolve)
+        if isinstance(tag, importer.ImportedLink):
+            if tag.replacement is not None:
+                # URLs in a stylesheet are relative to the stylesheet.
+                tag.replacement.text = rewriter.rewrite_css(
+                    tag.replacement.text, tag.relative_url)
+            elif tag.path is not None and is_icon_link(tag.el):
+                tag.el.attrib['href'] = rewriter.rewrite_resolved(
+                    tag.relative_url, tag.path)
+        elif isinstance(tag, importer.ImportedStyle):
+            if tag.el.text:
+                tag.el.text = rewriter.rewrite_css(
+                    tag.el.text, parent_relative_url)
+        elif isinstance(tag, importer.ImportedPolymerElement):
+            rewriter.rewrite_element(tag.el, parent_relative_url)
+        elif isinstance(tag, importer.ImportedHtml):
+            # Resources nested in the body are imported as tags of their
+            # own, so only rewrite what's around them.
+            for el in tag.body_tags:
+                rewriter.rewrite_element(
+                    el, tag.relative_url, skip_tags=RESOURCE_TAGS)
+        return rewriter.inlined_paths
+
+    def get_data_uri(self, path, files=None):
+        """Returns the data URI for the file, or None if it's too large.
+
+        Args:
+            path: Path of the file.
+            files: Optional filesystem.Snapshot to look up the file in.
+
+        Raises:
+            OSError or IOError if the file doesn't exist.
+        """
+        stat = files.stat(path) if files is not None else os.stat(path)
+        if stat.st_size > self.max_bytes:
+            return None
+
+        with self.lock:
+            entry = self.data_uris.get(path)
+        if entry is not None:
+            mtime, size, data_uri = entry
+            if mtime == stat.st_mtime and size == stat.st_size:
+                return data_uri
+
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        data_uri = 'data:%s;base64,%s' % (
+            get_content_type(path), base64.b64encode(data))
+        with self.lock:
+            self.data_uris[path] = (stat.st_mtime, stat.st_size, data_uri)
+        return data_uri
+
+
+class Rewriter(object):
+    """Rewrites asset URLs for one imported tag."""
+
+    def __init__(self, inliner, resolve):
+        self.inliner = inliner
+        self.resolve = resolve
+        self.inlined_paths = []
+
+    def rewrite_element(self, el, parent_relative_url, skip_tags=()):
+        for child_el in iter_elements(el, skip_tags=skip_tags):
+            if not isinstance(child_el.tag, basestring):
+                continue  # Comments, etc.
+            if child_el.tag == 'img' and 'src' in child_el.attrib:
+                child_el.attrib['src'] = self.rewrite_url(
+                    child_el.attrib['src'], parent_relative_url)
+            elif (child_el.tag == 'link' and 'href' in child_el.attrib and
+                    is_icon_link(child_el)):
+                child_el.attrib['href'] = self.rewrite_url(
+                    child_el.attrib['href'], parent_relative_url)
+            elif child_el.tag == 'style' and child_el.text:
+                child_el.text = self.rewrite_css(
+                    child_el.text, parent_relative_url)
+
+            if 'style' in child_el.attrib:
+                child_el.attrib['style'] = self.rewrite_css(
+                    child_el.attrib['style'], parent_relative_url)
+
+    def rewrite_css(self, text, parent_relative_url):
+        def replace(match):
+            quote, url = match.groups()
+            new_url = self.rewrite_url(url, parent_relative_url)
+            return 'url(%s%s%s)' % (quote, new_url, quote)
+
+        return CSS_URL_RE.sub(replace, text)
+
+    def rewrite_url(self, url, parent_relative_url):
+        if not is_rewritable(url):
+            return url
+        url = url.strip()
+        if importer.is_remote_url(url):
+            return url
+        if (parent_relative_url is not None and
+                importer.is_remote_url(parent_relative_url)):
+            # Don't fetch assets of remote resources, just make their URLs
+            # absolute so they still work from the index file.
+            return urlparse.urljoin(parent_relative_url, url)
+
+        # Keep the query and fragment for rebased URLs. Assets with either
+        # are never inlined since they may mean something to the server.
+        suffix = ''
+        match = re.search(r'[?#]', url)
+        if match:
+            suffix = url[match.start():]
+            url = url[:match.start()]
+
+        relative_url, path = self.resolve(
+            url, parent_relative_url=parent_relative_url)
+        return self.rewrite_resolved(relative_url, path, suffix=suffix)
+
+    def rewrite_resolved(self, relative_url, path, suffix=''):
+        if path is None:
+            return relative_url + suffix
+
+        if not suffix:
+            try:
+                data_uri = self.inliner.get_data_uri(path, self.resolve.files)
+            except (IOError, OSError):
+                logging.debug('Asset %r does not exist', path)
+                data_uri = None
+            if data_uri is not None:
+                logging.debug('Inlining asset %r', relative_url)
+                self.inlined_paths.append(path)
+                return data_uri
+
+        if (importer.is_remote_url(relative_url) or
+                relative_url.startswith('/')):
+            return relative_url + suffix
+
+        return posixpath.relpath(
+            relative_url, self.resolve.root_url or '.') + suffix
@@ -0,0 +1,482 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from copy import deepcopy
+import Queue
+import errno
+import hashlib
+import logging
+import os
+from stat import S_ISREG
+import threading
+import time
+
+from lxml import etree
+
+from . import filesystem
+from . import importer
+from . pipeline import build
+
+
+# Default memory budget for built bundles and parsed trees kept around
+# between builds.
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# How often to check whether the files of a bundle changed, in seconds.
+DEFAULT_POLL_INTERVAL = 0.5
+
+# Default memory budget for the contents of small static files.
+DEFAULT_MAX_FILE_CACHE_BYTES = 8 * 1024 * 1024
+
+# Static files up to this size are kept in memory; larger ones are copied
+# straight from disk on every request.
+DEFAULT_MAX_FILE_BYTES = 64 * 1024
+
+# Rough ratio of the memory used by a parsed lxml tree to the size of the
+# HTML file it came from.
+TREE_SIZE_FACTOR = 8
+
+
+class LruCache(object):
+    """Least-recently-used cache bounded by the total size of its values.
+
+    Thread-safe. The size of each value is computed with the sizeof function.
+    """
+
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, size = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = self.sizeof(value)
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                logging.debug('Not caching %r; %d bytes is over budget',
+                              key, size)
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_key, (_, evicted_size) = (
+                    self.entries.iteritems().next())
+                logging.debug('Evicting %r', evicted_key)
+                self._remove(evicted_key)
+                self.evictions += 1
+                self.evicted_bytes += evicted_size
+
+    def pop(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        try:
+            _, size = self.entries.pop(key)
+        except KeyError:
+            return
+        self.total_bytes -= size
+
+    def stats(self):
+        """Returns a dictionary of counters for monitoring the cache."""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TreeCache(object):
+    """Keeps parsed HTML trees so unchanged imports aren't parsed again.
+
+    Assembling a document moves elements around in the trees it was given,
+    so callers always get a copy of the cached tree.
+    """
+
+    def __init__(self, lru):
+        self.lru = lru
+
+    def get(self, path, files=None):
+        """Returns a parsed copy of the HTML file at the given path.
+
+        Args:
+            path: Path of the file.
+            files: Optional filesystem.Snapshot to look up the file in.
+
+        Raises:
+            IOError if the file doesn't exist.
+        """
+        if files is None:
+            files = filesystem.Snapshot()
+        try:
+            stat = files.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        key = ('tree', path)
+        entry = self.lru.get(key)
+        if entry is not None:
+            mtime, size, tree = entry
+            if mtime == stat.st_mtime and size == stat.st_size:
+                return deepcopy(tree)
+
+        tree = importer.parse_html(path, files=files)
+        self.lru.put(key, (stat.st_mtime, stat.st_size, tree),
+                     size=stat.st_size * TREE_SIZE_FACTOR)
+        return deepcopy(tree)
+
+
+class FragmentCache(object):
+    """Keeps the serialized bytes of document fragments between builds.
+
+    Fragments are keyed by a hash of their content, so a polymer-element or
+    inlined resource that didn't change is only serialized once.
+    """
+
+    def __init__(self, lru):
+        self.lru = lru
+
+    def get(self, el, serialize_element):
+        """Returns the serialized bytes of the given element.
+
+        Args:
+            el: Element to serialize, detached from its document.
+            serialize_element: Function that serializes an element.
+        """
+        key = ('fragment', hashlib.sha1(etree.tostring(el)).hexdigest())
+        output = self.lru.get(key)
+        if output is None:
+            output = serialize_element(el)
+            self.lru.put(key, output)
+        return output
+
+
+class BundleCache(object):
+    """Keeps built bundles in memory until their dependencies change.
+
+    Bundles and the parsed trees of the files they include share a single
+    memory budget. Each call to get looks at the files through a new
+    snapshot of the file system. Any build_options are passed to
+    pipeline.build.
+    """
+
+    def __init__(self, root_dir, max_bytes=DEFAULT_MAX_BYTES, **build_options):
+        self.root_dir = root_dir
+        self.build_options = build_options
+        self.lru = LruCache(max_bytes)
+        self.trees = TreeCache(self.lru)
+        self.fragments = FragmentCache(self.lru)
+        self.files = filesystem.FileSystem()
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, index_path):
+        """Returns a Bundle for the given index file, rebuilding if stale.
+
+        Raises:
+            IOError if the index_path or any of its dependencies don't
+            exist on disk.
+        """
+        # The same file may be reached through different relative paths.
+        index_path = os.path.abspath(index_path)
+        key = ('bundle', index_path)
+        files = self.files.snapshot()
+        bundle = self.lru.get(key)
+        if bundle is not None and not bundle.is_stale(files):
+            return bundle
+
+        logging.debug('Building %r', index_path)
+        bundle = build(self.root_dir, index_path, tree_cache=self.trees,
+                       fragment_cache=self.fragments, files=files,
+                       **self.build_options)
+        with self.lock:
+            self.builds += 1
+        self.lru.put(key, bundle)
+        return bundle
+
+    def __contains__(self, index_path):
+        return ('bundle', os.path.abspath(index_path)) in self.lru
+
+    def stats(self):
+        result = self.lru.stats()
+        result['builds'] = self.builds
+        result['files'] = self.files.stats()
+        return result
+
+
+class StaticFile(object):
+    """Validators and, for small files, the contents of a static file."""
+
+    def __init__(self, path, stat, content=None):
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.etag = '%x-%x' % (int(stat.st_mtime * 1000000), stat.st_size)
+        self.content = content
+
+
+class FileCache(object):
+    """Keeps the contents of small, frequently requested static files."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_FILE_CACHE_BYTES,
+                 max_file_bytes=DEFAULT_MAX_FILE_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.lru = LruCache(max_bytes)
+
+    def get(self, path):
+        """Returns a StaticFile for the given path.
+
+        Raises:
+            OSError or IOError if the file doesn't exist or isn't a regular
+            file.
+        """
+        stat = os.stat(path)
+        if not S_ISREG(stat.st_mode):
+            raise IOError(errno.EISDIR, 'Not a regular file', path)
+        static_file = self.lru.get(path)
+        if (static_file is not None and
+                static_file.mtime == stat.st_mtime and
+                static_file.size == stat.st_size):
+            return static_file
+
+        if stat.st_size > self.max_file_bytes:
+            return StaticFile(path, stat)
+
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        static_file = StaticFile(path, stat, content=content)
+        self.lru.put(path, static_file, size=len(content))
+        return static_file
+
+    def stats(self):
+        return self.lru.stats()
+
+
+def get_mtimes(paths, files=None):
+    """Returns a dictionary of the current modification times of the paths.
+
+    Missing files have a modification time of None.
+    """
+    if files is None:
+        files = filesystem.Snapshot()
+    return files.get_mtimes(paths)
+
+
+def get_failed_paths(bundle, error):
+    """Returns the paths to watch for changes after a failed rebuild.
+
+    A rebuild usually fails because a file was just changed to import one
+    that doesn't exist yet, so the file the error is about is watched along
+    with the bundle's files.
+    """
+    paths = set(bundle.dependencies)
+    path = getattr(error, 'filename', None)
+    if path:
+        paths.add(path)
+    return paths
+
+
+class Entry(object):
+    """Latest good build of an index file and the state of its rebuild."""
+
+    def __init__(self, index_path, pinned=False):
+        self.index_path = index_path
+        # Pinned entries are watched for as long as the builder runs. Others
+        # are dropped once their bundle is evicted from the cache.
+        self.pinned = pinned
+        self.bundle = None
+        self.error = None
+        self.rebuilding = False
+        # When the current bundle was found to be out of date.
+        self.stale_since = None
+        # Modification times of the bundle's files, and of the file the build
+        # failed on, when a rebuild failed. Another rebuild is only tried
+        # after one of them changes again.
+        self.failed_mtimes = None
+
+    def is_stale(self, files=None):
+        if self.bundle is None:
+            return True
+        if self.failed_mtimes is not None:
+            return get_mtimes(self.failed_mtimes, files) != self.failed_mtimes
+        return self.bundle.is_stale(files)
+
+
+class BackgroundBuilder(object):
+    """Rebuilds bundles in a background thread as soon as their files change.
+
+    While a rebuild is in flight requests get the last good bundle right away
+    (stale-while-revalidate), or wait for the rebuild to finish when
+    wait_for_rebuild is True.
+
+    Only the watcher thread checks whether bundles are out of date, so
+    requests never wait on the disk. The index files given to start are
+    watched for as long as the builder runs; other bundles are watched
+    until the cache evicts them.
+    """
+
+    def __init__(self, cache, poll_interval=DEFAULT_POLL_INTERVAL,
+                 wait_for_rebuild=False):
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.wait_for_rebuild = wait_for_rebuild
+        self.condition = threading.Condition()
+        self.entries = {}
+        self.queue = Queue.Queue()
+
+    def start(self, index_paths=()):
+        """Starts the background threads and builds the given index files."""
+        with self.condition:
+            for index_path in index_paths:
+                self._schedule(self._get_entry(index_path, pinned=True))
+
+        for target in (self._work, self._watch):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def get(self, index_path):
+        """Returns the latest bundle for the given index file.
+
+        Returns:
+            Tuple (bundle, stale_seconds) where stale_seconds is how long
+            the bundle has been out of date, or None if it's current.
+
+        Raises:
+            IOError or another exception if the index file has never built
+            successfully.
+        """
+        with self.condition:
+            entry = self._get_entry(index_path)
+            if entry.bundle is None and not entry.rebuilding:
+                # Never built, or the last attempt failed.
+                self._schedule(entry)
+
+            if entry.bundle is None or self.wait_for_rebuild:
+                while entry.rebuilding:
+                    self.condition.wait()
+
+            if entry.bundle is None:
+                raise entry.error
+
+            stale_seconds = None
+            if entry.stale_since is not None:
+                stale_seconds = time.time() - entry.stale_since
+            return entry.bundle, stale_seconds
+
+    def _get_entry(self, index_path, pinned=False):
+        # Must be called while holding the condition.
+        index_path = os.path.abspath(index_path)
+        entry = self.entries.get(index_path)
+        if entry is None:
+            entry = Entry(index_path, pinned=pinned)
+            self.entries[index_path] = entry
+        entry.pinned = entry.pinned or pinned
+        return entry
+
+    def _evict(self):
+        # Must be called while holding the condition.
+        for index_path, entry in self.entries.items():
+            if entry.pinned or entry.rebuilding:
+                continue
+            if entry.bundle is None or index_path not in self.cache:
+                logging.debug('No longer watching %r', index_path)
+                del self.entries[index_path]
+
+    def _schedule(self, entry):
+        # Must be called while holding the condition.
+        entry.rebuilding = True
+        if entry.bundle is not None and entry.stale_since is None:
+            entry.stale_since = time.time()
+        self.queue.put(entry)
+
+    def _work(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                bundle = self.cache.get(entry.index_path)
+            except Exception as e:
+                logging.exception('Could not rebuild %r', entry.index_path)
+                # Only this thread changes entry.bundle, so it's safe to
+                # read without the lock while looking at the files.
+                failed_mtimes = None
+                if entry.bundle is not None:
+                    failed_mtimes = get_mtimes(
+                        get_failed_paths(entry.bundle, e))
+                with self.condition:
+                    entry.error = e
+                    entry.failed_mtimes = failed_mtimes
+            else:
+                with self.condition:
+                    entry.bundle = bundle
+                    entry.error = None
+                    entry.stale_since = None
+                    entry.failed_mtimes = None
+            finally:
+                with self.condition:
+                    entry.rebuilding = False
+                    self.condition.notify_all()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.condition:
+                self._evict()
+                entries = [entry for entry in self.entries.itervalues()
+                           if entry.bundle is not None and not entry.rebuilding]
+
+            # Look at the files without holding the lock so requests don't
+            # wait on the disk. Bundles share many files, so check them all
+            # in one snapshot.
+            files = self.cache.files.snapshot()
+            stale = [entry for entry in entries if entry.is_stale(files)]
+
+            with self.condition:
+                for entry in stale:
+                    if not entry.rebuilding:
+                        logging.debug('Files changed for %r',
+                                      entry.index_path)
+                        self._schedule(entry)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Writes precompressed copies of output files for static servers."""
+
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Default compression level for gzip, and quality for brotli.
+DEFAULT_LEVEL = 9
+
+# Files larger than this are gzipped in chunks on several threads.
+GZIP_CHUNK_BYTES = 1024 * 1024
+
+# Extension of the file next to each output that holds the SHA-1 of the
+# contents its sidecars were made from, and how they were compressed.
+DIGEST_EXTENSION = '.sha1'
+
+
+def get_encodings():
+    """Returns the file extensions of the supported compression formats."""
+    if brotli is None:
+        return ['.gz']
+    return ['.gz', '.br']
+
+
+def gzip_chunk(data, level, last):
+    """Returns raw deflate data for one chunk of a larger file.
+
+    Chunks that aren't last end with a sync flush, so their concatenation is
+    one valid deflate stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    result = compressor.compress(data)
+    if last:
+        return result + compressor.flush(zlib.Z_FINISH)
+    return result + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def gzip_wrap(deflated, data, mtime):
+    """Returns the deflate stream for data wrapped in a gzip header."""
+    header = struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, int(mtime), 0, 255)
+    trailer = struct.pack(
+        '<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    return header + deflated + trailer
+
+
+def get_digest(data, level):
+    """Returns what the digest file holds for sidecars made from the data.
+
+    Besides the SHA-1 of the data, this has the level and the encodings, so
+    changing either makes the sidecars again.
+    """
+    return '%s %d %s' % (
+        hashlib.sha1(data).hexdigest(), level, ','.join(get_encodings()))
+
+
+def read_digest(path):
+    """Returns the digest of the contents the file's sidecars came from."""
+    try:
+        with open(path + DIGEST_EXTENSION) as handle:
+            return handle.read().strip()
+    except IOError:
+        return None
+
+
+def compress_files(paths, level=DEFAULT_LEVEL, threads=None):
+    """Writes a compressed sidecar next to each file for each encoding.
+
+    The SHA-1 of each file's contents is written next to it with the level
+    and encodings, and sidecars made the same way from the same contents are
+    left alone, so files that didn't change aren't compressed again. Files and the chunks of large files are
+    compressed in parallel; zlib and brotli release the GIL.
+
+    Args:
+        paths: Paths of the files to compress.
+        level: Compression level from 1 to 9.
+        threads: Number of threads to compress with, or None for the number
+            of CPUs.
+
+    Returns:
+        List of the sidecar paths that were written.
+    """
+    # Each job is (sidecar path, data, encoding, chunk index, chunk count).
+    jobs = []
+    contents = {}
+    digests = {}
+    for path in paths:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        digest = get_digest(data, level)
+        unchanged = read_digest(path) == digest
+        for encoding in get_encodings():
+            sidecar_path = path + encoding
+            if unchanged and os.path.exists(sidecar_path):
+                logging.debug('Sidecar %r is up to date', sidecar_path)
+                continue
+            contents[path] = data
+            digests[path] = digest
+            if encoding == '.br':
+                jobs.append((sidecar_path, data, encoding, 0, 1))
+                continue
+            chunks = [data[i:i + GZIP_CHUNK_BYTES]
+                      for i in xrange(0, len(data), GZIP_CHUNK_BYTES)] or ['']
+            for index, chunk in enumerate(chunks):
+                jobs.append((sidecar_path, chunk, encoding, index, len(chunks)))
+
+    if not jobs:
+        return []
+
+    def compress(job):
+        _, data, encoding, index, count = job
+        if encoding == '.br':
+            return brotli.compress(data, quality=level)
+        return gzip_chunk(data, level, index == count - 1)
+
+    pool = ThreadPool(threads)
+    try:
+        results = pool.map(compress, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    outputs = {}
+    for job, result in zip(jobs, results):
+        outputs.setdefault(job[0], []).append(result)
+
+    written = []
+    now = time.time()
+    for path in paths:
+        data = contents.get(path)
+        for encoding in get_encodings():
+            sidecar_path = path + encoding
+            if sidecar_path not in outputs:
+                continue
+            output = ''.join(outputs[sidecar_path])
+            if encoding == '.gz':
+                output = gzip_wrap(output, data, now)
+            with open(sidecar_path, 'wb') as handle:
+                handle.write(output)
+            written.append(sidecar_path)
+
+        if data is not None:
+            # Written last so an interrupted run compresses the file again.
+            with open(path + DIGEST_EXTENSION, 'w') as handle:
+                handle.write(digests[path] + '\n')
+
+    return written
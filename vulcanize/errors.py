@@ -25,3 +25,7 @@ class InvalidScriptError(Error):
 
 class InvalidLinkError(Error):
     pass
+
+
+class FetchError(Error):
+    pass
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fetches remote resources into an on-disk cache so they can be inlined."""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib2
+
+from . import errors
+
+
+# Default directory for fetched resources, relative to the working directory.
+DEFAULT_CACHE_DIR = '.vulcanize_cache'
+
+# How long a fetched resource is used before asking the remote server
+# whether it changed, in seconds.
+DEFAULT_MAX_AGE = 300
+
+# Timeout for fetching a single resource, in seconds.
+DEFAULT_TIMEOUT = 30
+
+
+class RemoteCache(object):
+    """Fetches remote URLs and returns the paths of their local copies.
+
+    Each URL is stored as a content file and a JSON file with the response's
+    validators, which are sent along the next time the URL is fetched. In
+    offline mode the cached copies are used without contacting the network.
+
+    Thread-safe.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, offline=False,
+                 max_age=DEFAULT_MAX_AGE, timeout=DEFAULT_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.max_age = max_age
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # Map of URL to the last time it was checked with the remote server.
+        self.checked = {}
+
+    def __call__(self, url):
+        """Returns the path of the local copy of the given URL.
+
+        Raises:
+            errors.FetchError if the URL can't be fetched and there's no
+            cached copy of it.
+        """
+        key = hashlib.sha1(url).hexdigest()
+        path = os.path.join(self.cache_dir, key)
+        meta_path = path + '.json'
+
+        meta = None
+        if os.path.exists(path):
+            try:
+                with open(meta_path) as handle:
+                    meta = json.load(handle)
+            except (IOError, ValueError):
+                pass
+
+        if meta is not None:
+            if self.offline:
+                return path
+            with self.lock:
+                checked = self.checked.get(url)
+            if checked is not None and time.time() - checked < self.max_age:
+                return path
+        elif self.offline:
+            raise errors.FetchError('%r is not cached' % url)
+
+        request = urllib2.Request(url)
+        if meta is not None:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last_modified'):
+                request.add_header('If-Modified-Since', meta['last_modified'])
+
+        try:
+            response = urllib2.urlopen(request, timeout=self.timeout)
+            content = response.read()
+        except urllib2.HTTPError as e:
+            if e.code == 304 and meta is not None:
+                logging.debug('Not modified %r', url)
+                self._mark_checked(url)
+                return path
+            return self._fallback(url, path, meta, e)
+        except IOError as e:
+            return self._fallback(url, path, meta, e)
+
+        logging.debug('Fetched %r into %r', url, path)
+        meta = {
+            'url': url,
+            'etag': response.info().getheader('ETag'),
+            'last_modified': response.info().getheader('Last-Modified'),
+        }
+        self._write(path, content)
+        self._write(meta_path, json.dumps(meta))
+        self._mark_checked(url)
+        return path
+
+    def _fallback(self, url, path, meta, error):
+        if meta is None:
+            raise errors.FetchError('Could not fetch %r: %s' % (url, error))
+        logging.warning('Using cached copy of %r: %s', url, error)
+        return path
+
+    def _mark_checked(self, url):
+        with self.lock:
+            self.checked[url] = time.time()
+
+    def _write(self, path, data):
+        # Write to a temporary file first so concurrent builds never see
+        # a partially written file.
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(data)
+        os.rename(temp_path, path)
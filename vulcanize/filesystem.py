@@ -0,0 +1,135 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Memoized view of the file system shared by the stages of a build."""
+
+import os
+import threading
+
+
+class FileSystem(object):
+    """Hands out snapshots of the file system and counts how they're used.
+
+    Each snapshot is one generation: it remembers every lookup made through
+    it, so a build or a freshness check only touches the disk once per file.
+    Take a new snapshot to see changes made since.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def snapshot(self):
+        with self.lock:
+            self.generations += 1
+        return Snapshot(self)
+
+    def count(self, hits=0, misses=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        """Returns a dictionary of counters for monitoring the snapshots."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'generations': self.generations,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+
+class Snapshot(object):
+    """Memoized stat results and resolved URLs.
+
+    Not thread-safe; each thread should take its own snapshot.
+
+    Args:
+        file_system: Optional FileSystem to count hits and misses in.
+    """
+
+    def __init__(self, file_system=None):
+        self.file_system = file_system or FileSystem()
+        # Map of path to its os.stat result, or the OSError it raised.
+        self.stats = {}
+        # Map of keys given to memoize to their values.
+        self.values = {}
+
+    def stat(self, path):
+        """Returns the os.stat result for the path.
+
+        Raises:
+            OSError if the path doesn't exist.
+        """
+        result = self.stats.get(path)
+        if result is not None:
+            self.file_system.count(hits=1)
+        else:
+            self.file_system.count(misses=1)
+            try:
+                result = os.stat(path)
+            except OSError as e:
+                result = e
+            self.stats[path] = result
+
+        if isinstance(result, OSError):
+            raise result
+        return result
+
+    def getmtime(self, path):
+        return self.stat(path).st_mtime
+
+    def get_mtimes(self, paths):
+        """Returns a dictionary of the modification times of the paths.
+
+        Missing files have a modification time of None.
+        """
+        result = {}
+        for path in paths:
+            try:
+                result[path] = self.getmtime(path)
+            except OSError:
+                result[path] = None
+        return result
+
+    def open(self, path, mode='r'):
+        """Opens the file, failing fast if the snapshot has it as missing.
+
+        Raises:
+            IOError if the file doesn't exist.
+        """
+        try:
+            self.stat(path)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, path)
+        return open(path, mode)
+
+    def memoize(self, key, function, *args):
+        """Returns function(*args), computing it once per snapshot."""
+        try:
+            result = self.values[key]
+        except KeyError:
+            self.file_system.count(misses=1)
+            result = function(*args)
+            self.values[key] = result
+        else:
+            self.file_system.count(hits=1)
+        return result
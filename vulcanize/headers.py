@@ -0,0 +1,51 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for HTTP caching headers shared by the servers."""
+
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+
+def format_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def format_etag(digest):
+    return '"%s"' % digest
+
+
+def is_not_modified(etag, mtime, if_none_match=None, if_modified_since=None):
+    """Returns True if the client's validators match the current resource.
+
+    Args:
+        etag: Quoted entity tag of the current resource.
+        mtime: Modification time of the current resource in seconds.
+        if_none_match: Value of the If-None-Match request header, if any.
+        if_modified_since: Value of the If-Modified-Since request header,
+            if any.
+    """
+    if if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since.
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+
+    if if_modified_since:
+        parsed = parsedate_tz(if_modified_since)
+        if parsed is None:
+            return False
+        return int(mtime) <= mktime_tz(parsed)
+
+    return False
@@ -17,7 +17,9 @@
 from cStringIO import StringIO
 import logging
 import os.path
+import posixpath
 import re
+import urlparse
 import warnings
 
 import html5lib
@@ -26,6 +28,7 @@ from html5lib.constants import DataLossWarning
 from lxml import html
 
 from . import errors
+from . trace import NULL_TRACER
 
 # Ignore coertion warnings from html5lib. This happens because of foo ?= "bar"
 # conditional attribute expressions in the HTML documents. We compensate for
@@ -48,10 +51,24 @@ class ImportedTag(object):
         self.el = el
         self.resource_tags = []
         self.polymer_element_ancestor = None
+        # Paths of assets that were inlined into this tag.
+        self.asset_paths = []
+        # filesystem.Snapshot to read files through, if any.
+        self.files = None
 
     def parse(self):
         pass
 
+    @property
+    def read_paths(self):
+        """Paths of the files that were read to parse this tag."""
+        return []
+
+    def open_file(self):
+        if self.files is None:
+            return open(self.path)
+        return self.files.open(self.path)
+
     @property
     def is_included_resource(self):
         return self.relative_url is not None
@@ -61,24 +78,38 @@ class ImportedTag(object):
             self.__class__.__name__, self.relative_url, self.path, self.el)
 
 
+def parse_html(path, files=None):
+    """Returns the lxml tree for the HTML file at the given path.
+
+    Args:
+        path: Path of the file to parse.
+        files: Optional filesystem.Snapshot to open the file through.
+    """
+    tree_builder = html5lib.getTreeBuilder('lxml')
+    parser = html5lib.HTMLParser(
+        namespaceHTMLElements=False,
+        tree=tree_builder,
+        debug=True)
+    with (files.open(path) if files is not None else open(path)) as handle:
+        return parser.parse(
+            handle,
+            encoding='utf-8')
+
+
 class ImportedHtml(ImportedTag):
 
-    def __init__(self, relative_url, path):
+    def __init__(self, relative_url, path, tree_cache=None):
         super(ImportedHtml, self).__init__(
             relative_url=relative_url, path=path)
+        self.tree_cache = tree_cache
         self.head_tags = []
         self.body_tags = []
 
     def parse(self):
-        tree_builder = html5lib.getTreeBuilder('lxml')
-        parser = html5lib.HTMLParser(
-            namespaceHTMLElements=False,
-            tree=tree_builder,
-            debug=True)
-        with open(self.path) as handle:
-            self.el = parser.parse(
-                handle,
-                encoding='utf-8')
+        if self.tree_cache is not None:
+            self.el = self.tree_cache.get(self.path, files=self.files)
+        else:
+            self.el = parse_html(self.path, files=self.files)
 
         seen_tags = set()
 
@@ -110,6 +141,12 @@ class ImportedHtml(ImportedTag):
                 seen_tags.add(el)
                 self.body_tags.append(el)
 
+    @property
+    def read_paths(self):
+        if self.el is None:
+            return []
+        return [self.path]
+
 
 class ImportedScript(ImportedTag):
 
@@ -122,10 +159,10 @@ class ImportedScript(ImportedTag):
         if self.path:
             # Local resource can be read and possibly inlined.
             assert not self.text
-            with open(self.path) as handle:
+            with self.open_file() as handle:
                 self.text = handle.read()
 
-        if self.relative_url:
+        if self.relative_url and self.text is not None:
             self.text = '\n// From %s\n%s' % (self.relative_url, self.text)
 
         if self.text:
@@ -162,6 +199,12 @@ class ImportedScript(ImportedTag):
         self.text = "%sPolymer('%s'%s%s%s" % (
             before, name, middle, closing, after)
 
+    @property
+    def read_paths(self):
+        if self.path is None:
+            return []
+        return [self.path]
+
     @property
     def is_included_resource(self):
         return self.relative_url and not self.text
@@ -184,6 +227,12 @@ class ImportedLink(ImportedTag):
             relative_url=relative_url, path=path, el=link_el)
         self.replacement = None
 
+    @property
+    def read_paths(self):
+        if self.replacement is None:
+            return []
+        return [self.path]
+
     def parse(self):
         if not self.path:
             return
@@ -202,7 +251,7 @@ class ImportedLink(ImportedTag):
         output = StringIO()
         output.write('\n/* From %s */\n' % self.relative_url)
 
-        with open(self.path) as handle:
+        with self.open_file() as handle:
             output.write(handle.read())
 
         self.replacement.text = output.getvalue()
@@ -262,11 +311,47 @@ class ImportedPolymerElement(ImportedTag):
         return False
 
 
-class PathResolver(object):
+# Values of rel for the links whose remote URLs are fetched to be inlined.
+FETCHED_LINK_RELS = ('stylesheet', 'import')
+
+
+def is_remote_url(url):
+    return url.startswith('http://') or url.startswith('https://')
 
-    def __init__(self, root_dir, index_path):
+
+def normalize_remote_url(url):
+    """Removes '..' and other relative path pieces from a remote URL."""
+    parts = urlparse.urlsplit(url)
+    path = posixpath.normpath(parts.path) if parts.path else ''
+    if parts.path.endswith('/') and not path.endswith('/'):
+        path += '/'
+    return urlparse.urlunsplit(
+        (parts.scheme, parts.netloc, path, parts.query, parts.fragment))
+
+
+class PathResolver(object):
+    """Maps URLs in documents to normalized relative URLs and file paths.
+
+    Args:
+        root_dir: Path to the directory root for vulcanizing.
+        index_path: Path to the HTML file to vulcanize.
+        fetch: Optional function that takes a remote URL and returns
+            the path of a local copy of it. When None, remote URLs are
+            left external. See fetcher.RemoteCache.
+        doc_root: Optional path to the directory that root-absolute
+            URLs like '/foo/bar.html' are served from. When None,
+            those URLs are left external.
+        files: Optional filesystem.Snapshot that resolved URLs are
+            remembered in, so each one is only resolved once per build.
+    """
+
+    def __init__(self, root_dir, index_path, fetch=None, doc_root=None,
+                 files=None):
         self.index_path = index_path
         self.root_dir = root_dir
+        self.fetch = fetch
+        self.doc_root = doc_root
+        self.files = files
 
         abs_dir = os.path.abspath(self.root_dir)
         abs_index = os.path.abspath(self.index_path)
@@ -275,12 +360,38 @@ class PathResolver(object):
         self.index_relative_url = index_relative_url
         self.root_url = os.path.dirname(index_relative_url)
 
-    def __call__(self, relative_url, parent_relative_url=None):
-        if (relative_url.startswith('http://') or
-                relative_url.startswith('https://') or
-                relative_url.startswith('/')):
+    def __call__(self, relative_url, parent_relative_url=None, fetch=True):
+        """Returns a tuple (relative_url, path) for the URL.
+
+        The path is None if the URL has no local file. Remote URLs are only
+        fetched when fetch is True.
+        """
+        if self.files is None:
+            return self.resolve(relative_url, parent_relative_url, fetch)
+        key = ('resolve', self.root_dir, self.doc_root,
+               relative_url, parent_relative_url, fetch)
+        return self.files.memoize(
+            key, self.resolve, relative_url, parent_relative_url, fetch)
+
+    def resolve(self, relative_url, parent_relative_url, fetch):
+        if (parent_relative_url is not None and
+                is_remote_url(parent_relative_url)):
+            # References in a fetched file are relative to its URL.
+            relative_url = urlparse.urljoin(parent_relative_url, relative_url)
+
+        if is_remote_url(relative_url):
+            if self.fetch is None or not fetch:
+                return relative_url, None
+            relative_url = normalize_remote_url(relative_url)
+            return relative_url, self.fetch(relative_url)
+
+        if relative_url.startswith('//'):
+            # Protocol-relative URLs are always left external.
             return relative_url, None
 
+        if relative_url.startswith('/'):
+            return self.resolve_absolute(relative_url)
+
         if parent_relative_url is None:
             # This means we're dealing with a root dependency with no parent.
             # Assume the relative_url is already resolved.
@@ -294,29 +405,62 @@ class PathResolver(object):
         # Normalize and remove '..' and other relative path pieces.
         normalized_relative_url = os.path.normpath(resolved_relative_url)
 
+        if normalized_relative_url.startswith('/'):
+            # Relative to a parent that was root-absolute.
+            return self.resolve_absolute(normalized_relative_url)
+
         return (normalized_relative_url,
                 os.path.join(self.root_dir, normalized_relative_url))
 
+    def resolve_absolute(self, relative_url):
+        if self.doc_root is None:
+            return relative_url, None
+        normalized_relative_url = posixpath.normpath(relative_url)
+        parts = [p for p in normalized_relative_url.split('/') if p]
+        return (normalized_relative_url,
+                os.path.join(self.doc_root, *parts))
+
 
 class Importer(object):
 
-    def __init__(self, resolve):
+    def __init__(self, resolve, tree_cache=None, inline_assets=None,
+                 files=None, tracer=NULL_TRACER):
         self.resolve = resolve
+        self.tree_cache = tree_cache
+        self.inline_assets = inline_assets
+        self.files = files
+        self.tracer = tracer
 
     def __call__(self, parent_relative_url, el):
+        with self.tracer.span('resolve', parent_relative_url):
+            result = self.import_tag(parent_relative_url, el)
+
+        source = result.relative_url or parent_relative_url
+        with self.tracer.span('parse', source):
+            result.parse()
+
+        if self.inline_assets is not None:
+            with self.tracer.span('assets', source):
+                result.asset_paths = self.inline_assets.rewrite(
+                    result, parent_relative_url, self.resolve)
+
+        return result
+
+    def import_tag(self, parent_relative_url, el):
         if el.tag == 'script':
             result = self.import_script(parent_relative_url, el)
         elif el.tag == 'link':
             rel = el.attrib.get('rel')
             href = el.attrib.get('href')
-            if (rel == 'import' and not
-                    (href.startswith('http://') or
-                     href.startswith('https://') or
-                     href.startswith('/'))):
-                # Locally resolve any imports that aren't absolute paths.
+            result = None
+            if rel == 'import' and href is not None:
+                # Locally resolve any imports that the resolver can find
+                # a file for.
                 result = self.import_html(
                     href, parent_relative_url=parent_relative_url)
-            else:
+                if result.path is None:
+                    result = None
+            if result is None:
                 result = self.import_link(parent_relative_url, el)
         elif el.tag == 'polymer-element':
             result = self.import_polymer_element(parent_relative_url, el)
@@ -326,7 +470,7 @@ class Importer(object):
             assert False
 
         result.polymer_element_ancestor = polymer_element_ancestor(el)
-        result.parse()
+        result.files = self.files
         return result
 
     def import_html(self, relative_url, parent_relative_url=None):
@@ -334,7 +478,9 @@ class Importer(object):
             relative_url, parent_relative_url=parent_relative_url)
         logging.debug('Dependency %r of %r has file path %r',
                       relative_url, parent_relative_url, path)
-        return ImportedHtml(relative_url, path)
+        result = ImportedHtml(relative_url, path, tree_cache=self.tree_cache)
+        result.files = self.files
+        return result
 
     def import_script(self, parent_relative_url, script_el):
         try:
@@ -365,8 +511,11 @@ class Importer(object):
         except KeyError:
             raise errors.InvalidLinkError(html.tostring(link_el))
 
+        # Other kinds of links, like rel="preconnect" or rel="icon", are
+        # never inlined, so there's no reason to download them.
         relative_url, path = self.resolve(
-            href, parent_relative_url=parent_relative_url)
+            href, parent_relative_url=parent_relative_url,
+            fetch=rel in FETCHED_LINK_RELS)
 
         return ImportedLink(relative_url, link_el, path=path)
 
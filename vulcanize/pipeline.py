@@ -14,41 +14,331 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import OrderedDict
 from cStringIO import StringIO
-import os
+import hashlib
+import json
+import logging
+import posixpath
+import re
+import uuid
 
 import html5lib
+from lxml import etree
+from lxml import html
 
 from . import assembler
+from . import filesystem
 from . import importer
+from . trace import NULL_TRACER
 
 
-__all__ = ['vulcanize']
+__all__ = ['Bundle', 'build', 'vulcanize']
 
 
-def vulcanize(root_dir, index_path):
-    """Vulcanize the HTML file at the given path.
+class Bundle(object):
+    """Output of vulcanizing an index file and the files it came from."""
+
+    def __init__(self, index_path, output, dependencies, extra_outputs=None,
+                 links=()):
+        self.index_path = index_path
+        self.output = output
+        # Map of file path to its modification time when the bundle was built.
+        self.dependencies = dependencies
+        # Map of the URLs of other files that the output loads, relative to
+        # the output, to their contents.
+        self.extra_outputs = extra_outputs or OrderedDict()
+        # Values of HTTP Link headers to send with the output.
+        self.links = list(links)
+        self.etag = hashlib.sha1(output).hexdigest()
+
+    @property
+    def last_modified(self):
+        return max(self.dependencies.itervalues())
+
+    def is_stale(self, files=None):
+        """Returns True if any of the dependencies changed on disk.
+
+        Args:
+            files: Optional filesystem.Snapshot to look up the files in.
+        """
+        if files is None:
+            files = filesystem.Snapshot()
+        return files.get_mtimes(self.dependencies) != self.dependencies
+
+    def sizes(self):
+        """Returns a list of (url, size in bytes) for each output file.
+
+        The main output has a URL of None.
+        """
+        result = [(None, len(self.output))]
+        for url, output in self.extra_outputs.iteritems():
+            result.append((url, len(output)))
+        return result
+
+    def __len__(self):
+        return sum(size for _, size in self.sizes())
+
+    def __repr__(self):
+        return 'Bundle(index_path=%r, etag=%r)' % (self.index_path, self.etag)
+
+
+def build(root_dir, index_path, tree_cache=None, fetch=None, doc_root=None,
+          deferred_url=None, critical_elements=(), routes=(),
+          manifest_url=None, inline_assets=None, fragment_cache=None,
+          resource_hints=False, files=None, tracer=NULL_TRACER):
+    """Vulcanize the HTML file at the given path and track its dependencies.
 
     Args:
         root_dir: Path to the directory root for vulcanizing.
         index_path: Path to the HTML file to vulcanize.
+        tree_cache: Optional cache of parsed HTML trees to reuse between
+            builds. See cache.TreeCache.
+        fetch: Optional function that returns the path of a local copy of
+            a remote URL so it can be inlined. See fetcher.RemoteCache.
+        doc_root: Optional path to the directory that root-absolute URLs
+            are served from so they can be inlined.
+        deferred_url: Optional URL, relative to the output, of a separate
+            import for the polymer-elements that aren't needed for first
+            paint. When given, that import is in the bundle's extra_outputs
+            and is loaded asynchronously by the main output.
+        critical_elements: Names of polymer-elements to keep in the main
+            output in addition to the ones used by the index file's body.
+        routes: List of assembler.Route to build lazy bundles for. Each
+            bundle is in the bundle's extra_outputs and only contains the
+            files that the main output doesn't. Imports used by more than
+            one route go in the main output instead.
+        manifest_url: Optional URL, relative to the output, of a JSON
+            manifest mapping route names to the URLs of their bundles.
+        inline_assets: Optional assets.AssetInliner that inlines small
+            images and fonts referenced by imports as data URIs and rebases
+            the URLs of the rest.
+        fragment_cache: Optional cache of serialized document fragments to
+            reuse between builds. See cache.FragmentCache.
+        resource_hints: When True, the main output has preconnect and
+            preload hints for the resources that were left external, and
+            the bundle has the same hints as HTTP Link header values.
+        files: Optional filesystem.Snapshot that every file is looked up
+            and read through. The dependencies' modification times come
+            from it too, so they match the contents that were read.
+        tracer: Optional trace.Tracer that records the time spent in each
+            stage of the build and on each source file.
 
     Returns:
-        String of the vulcanized file.
+        Bundle instance.
 
     Raises:
         IOError if the target index_path or any of its dependencies
         don't exist on disk.
+        errors.FetchError if a remote resource couldn't be fetched.
     """
-    resolver = importer.PathResolver(root_dir, index_path)
-    import_tag = importer.Importer(resolver)
+    if files is None:
+        files = filesystem.Snapshot()
+
+    resolver = importer.PathResolver(
+        root_dir, index_path, fetch=fetch, doc_root=doc_root, files=files)
+    import_tag = importer.Importer(
+        resolver, tree_cache=tree_cache, inline_assets=inline_assets,
+        files=files, tracer=tracer)
     root_file = import_tag.import_html(resolver.index_relative_url)
-    root_file.parse()
+    with tracer.span('parse', root_file.relative_url):
+        root_file.parse()
     traverser = assembler.Traverser(import_tag)
-    root_el = assembler.assemble(root_file, traverser)
 
+    if len(routes) > 1:
+        # Import the files that routes share from the index file, so each
+        # element is only registered once however many views are visited.
+        for relative_url in find_shared_imports(import_tag, root_file, routes):
+            if not (importer.is_remote_url(relative_url) or
+                    relative_url.startswith('/')):
+                relative_url = posixpath.relpath(
+                    relative_url, resolver.root_url or '.')
+            root_file.resource_tags.append(html.Element(
+                'link', attrib={'rel': 'import', 'href': relative_url}))
+
+    split = None
+    if deferred_url is not None:
+        split = assembler.Split(
+            deferred_url, critical_elements=critical_elements)
+
+    hints = None
+    if resource_hints:
+        hints = assembler.ResourceHints()
+
+    with tracer.span('assemble'):
+        root_el = assembler.assemble(
+            root_file, traverser, split=split, hints=hints)
+    with tracer.span('serialize'):
+        output = serialize(root_el, fragment_cache=fragment_cache)
+
+    extra_outputs = OrderedDict()
+    if split is not None:
+        with tracer.span('serialize', deferred_url):
+            extra_outputs[deferred_url] = serialize(
+                split.document.to_element(), fragment_cache=fragment_cache)
+
+    dependency_paths = traverser.dependencies | set([root_file.path])
+
+    for route in routes:
+        route_traverser = assembler.Traverser(
+            import_tag,
+            file_index=assembler.FileIndex(traverser.file_index.index))
+        route_files = []
+        for route_file in import_route_files(import_tag, root_file, route):
+            if route_file.path is None:
+                logging.warning('Import %r of route %r is external',
+                                route_file.relative_url, route.name)
+                continue
+            if route_traverser.file_index.add(
+                    route_file.relative_url, route_file.path):
+                with tracer.span('parse', route_file.relative_url):
+                    route_file.parse()
+                route_files.append(route_file)
+                dependency_paths.add(route_file.path)
+
+        with tracer.span('assemble', route.url):
+            document = assembler.assemble_import(
+                route_files, route_traverser)
+        with tracer.span('serialize', route.url):
+            extra_outputs[route.url] = serialize(
+                document.to_element(), fragment_cache=fragment_cache)
+        dependency_paths |= route_traverser.dependencies
+
+    if manifest_url is not None:
+        manifest = {'routes': dict((r.name, r.url) for r in routes)}
+        extra_outputs[manifest_url] = json.dumps(
+            manifest, indent=2, separators=(',', ': '), sort_keys=True)
+
+    dependencies = {}
+    with tracer.span('stat'):
+        for path in dependency_paths:
+            dependencies[path] = files.getmtime(path)
+
+    links = []
+    if hints is not None:
+        links = hints.to_link_headers()
+
+    return Bundle(index_path, output, dependencies,
+                  extra_outputs=extra_outputs, links=links)
+
+
+def import_route_files(import_tag, root_file, route):
+    """Returns the unparsed ImportedHtml of each of the route's imports."""
+    return [import_tag.import_html(
+                entry_url, parent_relative_url=root_file.relative_url)
+            for entry_url in route.entry_urls]
+
+
+def find_shared_imports(import_tag, root_file, routes):
+    """Returns the relative URLs of the HTML imports used by several routes.
+
+    Args:
+        import_tag: Importer for the current build.
+        root_file: ImportedHtml of the index file.
+        routes: List of assembler.Route.
+
+    Returns:
+        Sorted list of relative URLs.
+    """
+    route_counts = {}
+    for route in routes:
+        traverser = assembler.Traverser(import_tag)
+        relative_urls = set()
+        for route_file in import_route_files(import_tag, root_file, route):
+            if (route_file.path is None or
+                    not traverser.file_index.add(
+                        route_file.relative_url, route_file.path)):
+                continue
+            route_file.parse()
+            for tag in traverser(route_file):
+                if isinstance(tag, importer.ImportedHtml):
+                    relative_urls.add(tag.relative_url)
+        for relative_url in relative_urls:
+            route_counts[relative_url] = route_counts.get(relative_url, 0) + 1
+
+    return sorted(relative_url
+                  for relative_url, count in route_counts.iteritems()
+                  if count > 1)
+
+
+def vulcanize(root_dir, index_path, **options):
+    """Vulcanize the HTML file at the given path.
+
+    Args:
+        root_dir: Path to the directory root for vulcanizing.
+        index_path: Path to the HTML file to vulcanize.
+        **options: Keyword arguments to pass to build.
+
+    Returns:
+        String of the vulcanized file.
+
+    Raises:
+        IOError if the target index_path or any of its dependencies
+        don't exist on disk.
+    """
+    return build(root_dir, index_path, **options).output
+
+
+def serialize(root_el, fragment_cache=None):
+    """Returns the given assembled document as a string.
+
+    Args:
+        root_el: Root element of the document.
+        fragment_cache: Optional cache of the serialized bytes of the
+            top-level elements in head and body and of the polymer-elements
+            in the hidden div, so unchanged ones aren't serialized again.
+            See cache.FragmentCache.
+    """
+    if fragment_cache is None:
+        return '<!doctype html>\n' + serialize_element(root_el)
+
+    # Swap each fragment for a uniquely named comment while the rest of the
+    # document is serialized, then splice the fragments' bytes back in.
+    nonce = uuid.uuid4().hex
+    fragments = []
+    for el in get_fragment_elements(root_el):
+        marker_el = etree.Comment('vulcanize-fragment-%s-%d' % (
+            nonce, len(fragments)))
+        marker_el.tail = el.tail
+        el.tail = None
+        el.getparent().replace(el, marker_el)
+        fragments.append((marker_el, el))
+
+    try:
+        output = serialize_element(root_el)
+        fragment_outputs = [
+            fragment_cache.get(el, serialize_element) for _, el in fragments]
+    finally:
+        for marker_el, el in fragments:
+            marker_el.getparent().replace(marker_el, el)
+            el.tail = marker_el.tail
+
+    marker_re = re.compile(r'<!--vulcanize-fragment-%s-(\d+)-->' % nonce)
+    output = marker_re.sub(
+        lambda match: fragment_outputs[int(match.group(1))], output)
+    return '<!doctype html>\n' + output
+
+
+def get_fragment_elements(root_el):
+    """Yields the elements of the document that are serialized separately."""
+    for parent_el in root_el:
+        if parent_el.tag not in ('head', 'body'):
+            continue
+        for el in list(parent_el):
+            if not isinstance(el.tag, basestring):
+                continue  # Comments, etc.
+            if el.tag == 'div' and el.attrib.get('hidden') == 'hidden':
+                for hidden_child_el in list(el):
+                    if isinstance(hidden_child_el.tag, basestring):
+                        yield hidden_child_el
+            else:
+                yield el
+
+
+def serialize_element(el):
+    """Returns the given element and its children as a string."""
     walker = html5lib.getTreeWalker('lxml')
-    stream = walker(root_el)
+    stream = walker(el)
     serializer = html5lib.serializer.HTMLSerializer(
         quote_attr_values=True,
         sanitize=False,
@@ -59,7 +349,6 @@ def vulcanize(root_dir, index_path):
         minimize_boolean_attributes=True)
 
     output = StringIO()
-    output.write('<!doctype html>\n')
 
     for token in serializer.serialize(stream, encoding='utf-8'):
         # This is super gross, but lxml is going to sanitize the input and
@@ -14,16 +14,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Tool for profiling the vulcanize tool."""
+"""Tool for profiling the vulcanize tool.
+
+Attributes the time and allocations of each build to the stages of the
+pipeline and to the source files they worked on, and prints the cProfile
+stats of the whole run. Results can be exported for flame graphs and
+callgrind viewers, or saved as a baseline that later runs are compared
+against.
+"""
 
 import argparse
 from cProfile import Profile
+import json
 import logging
 import os
 import pstats
 import sys
 
-from .. pipeline import vulcanize
+from .. pipeline import build
+from .. trace import Tracer
+
+
+# Stages and files faster than this are too noisy to compare to a baseline.
+MIN_COMPARE_SECONDS = 0.001
+
+# Stages and files with fewer allocations than this aren't compared either.
+MIN_COMPARE_ALLOCATIONS = 1000
 
 
 class Flags(object):
@@ -43,6 +59,41 @@ class Flags(object):
             action='store',
             type=int,
             default=10)
+        self.parser.add_argument(
+            '--collapsed',
+            help='Write the time of each stage and file in the collapsed '
+                 'stack format for flamegraph.pl to the given path.',
+            action='store',
+            type=str,
+            default=None)
+        self.parser.add_argument(
+            '--callgrind',
+            help='Write the cProfile stats in callgrind format to the given '
+                 'path, for viewers like KCachegrind.',
+            action='store',
+            type=str,
+            default=None)
+        self.parser.add_argument(
+            '--save-baseline',
+            help='Write the time and allocations of each stage and file as '
+                 'JSON to the given path.',
+            action='store',
+            type=str,
+            default=None)
+        self.parser.add_argument(
+            '--baseline',
+            help='Compare against a baseline written by --save-baseline and '
+                 'exit with an error if any stage regressed.',
+            action='store',
+            type=str,
+            default=None)
+        self.parser.add_argument(
+            '--threshold',
+            help='Fraction by which a stage may be slower or allocate more '
+                 'than the baseline before it counts as a regression.',
+            action='store',
+            type=float,
+            default=0.1)
         self.parser.add_argument(
             'index_path',
             help='Path to the index file to vulcanize.',
@@ -56,6 +107,8 @@ class Flags(object):
             self.parser.error('index_path required')
         if not os.path.isfile(self.index_path):
             self.parser.error('index_path %r does not exist' % self.index_path)
+        if self.baseline and not os.path.isfile(self.baseline):
+            self.parser.error('baseline %r does not exist' % self.baseline)
 
 
 FLAGS = Flags()
@@ -63,7 +116,106 @@ FLAGS = Flags()
 
 def run():
     for i in xrange(FLAGS.iterations):
-        vulcanize(os.getcwd(), FLAGS.index_path)
+        build(os.getcwd(), FLAGS.index_path)
+
+
+def run_traced():
+    """Returns a Tracer for each iteration."""
+    tracers = []
+    for i in xrange(FLAGS.iterations):
+        tracer = Tracer()
+        tracer.run(build, os.getcwd(), FLAGS.index_path, tracer=tracer)
+        tracers.append(tracer)
+    return tracers
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def summarize(per_iteration):
+    """Returns the median of each key's seconds and allocations.
+
+    Args:
+        per_iteration: List of dictionaries of key to a dictionary with
+            'seconds' and 'allocations', one for each iteration.
+    """
+    keys = set()
+    for results in per_iteration:
+        keys.update(results)
+
+    summary = {}
+    for key in keys:
+        empty = {'seconds': 0.0, 'allocations': 0}
+        values = [results.get(key, empty) for results in per_iteration]
+        summary[key] = {
+            'seconds': median([v['seconds'] for v in values]),
+            'allocations': median([v['allocations'] for v in values]),
+        }
+    return summary
+
+
+def print_summary(title, summary):
+    print '%-50s %12s %12s' % (title, 'median ms', 'allocations')
+    for key, value in sorted(summary.iteritems(),
+                             key=lambda item: -item[1]['seconds']):
+        print '%-50.50s %12.3f %12d' % (
+            key, value['seconds'] * 1000, value['allocations'])
+    print
+
+
+def find_regressions(title, baseline, current):
+    """Yields a message for each key in current that regressed."""
+    for key, before in sorted(baseline.iteritems()):
+        after = current.get(key)
+        if after is None:
+            continue
+        if (before['seconds'] >= MIN_COMPARE_SECONDS and
+                after['seconds'] > before['seconds'] * (1 + FLAGS.threshold)):
+            yield '%s %s took %.3fms, was %.3fms' % (
+                title, key, after['seconds'] * 1000, before['seconds'] * 1000)
+        if (before['allocations'] >= MIN_COMPARE_ALLOCATIONS and
+                after['allocations'] >
+                before['allocations'] * (1 + FLAGS.threshold)):
+            yield '%s %s allocated %d objects, was %d' % (
+                title, key, after['allocations'], before['allocations'])
+
+
+def write_collapsed(tracers, path):
+    totals = {}
+    for tracer in tracers:
+        for line in tracer.collapsed_stacks():
+            stack, value = line.rsplit(' ', 1)
+            totals[stack] = totals.get(stack, 0) + int(value)
+    with open(path, 'w') as handle:
+        for stack, value in sorted(totals.iteritems()):
+            handle.write('%s %d\n' % (stack, value))
+
+
+def write_callgrind(stats, path):
+    """Writes pstats in the callgrind format, with costs in microseconds."""
+    # pstats maps each function to its callers; callgrind wants callees.
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.iteritems():
+        for caller, caller_stats in callers.iteritems():
+            callees.setdefault(caller, []).append((func, caller_stats))
+
+    with open(path, 'w') as handle:
+        handle.write('events: Microseconds\n')
+        for func, (_, _, self_time, _, _) in sorted(stats.stats.iteritems()):
+            filename, line, name = func
+            handle.write('\nfl=%s\nfn=%s\n' % (filename, name))
+            handle.write('%d %d\n' % (line, self_time * 1000000))
+            for callee, caller_stats in sorted(callees.get(func, [])):
+                callee_filename, callee_line, callee_name = callee
+                # Each caller has (total calls, primitive calls, time,
+                # cumulative time); recursive calls are only in the total.
+                calls, cumulative_time = caller_stats[0], caller_stats[3]
+                handle.write('cfl=%s\ncfn=%s\n' % (
+                    callee_filename, callee_name))
+                handle.write('calls=%d %d\n' % (calls, callee_line))
+                handle.write('%d %d\n' % (line, cumulative_time * 1000000))
 
 
 def main():
@@ -72,15 +224,48 @@ def main():
     if FLAGS.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
+    tracers = run_traced()
+    stages = summarize([t.by_stage() for t in tracers])
+    sources = summarize([t.by_source() for t in tracers])
+    print_summary('stage', stages)
+    print_summary('file', sources)
+
+    if FLAGS.collapsed:
+        write_collapsed(tracers, FLAGS.collapsed)
+
+    if FLAGS.save_baseline:
+        with open(FLAGS.save_baseline, 'w') as handle:
+            json.dump({
+                'index_path': FLAGS.index_path,
+                'iterations': FLAGS.iterations,
+                'stages': stages,
+                'sources': sources,
+            }, handle, indent=2, separators=(',', ': '), sort_keys=True)
+
     profiler = Profile()
     profiler.runcall(run)
 
     stats = pstats.Stats(profiler)
+    if FLAGS.callgrind:
+        write_callgrind(stats, FLAGS.callgrind)
     stats.strip_dirs()
     stats.sort_stats('cumulative')
     stats.print_stats(.1)
     stats.print_callers(.1)
 
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as handle:
+            baseline = json.load(handle)
+        regressions = list(find_regressions(
+            'stage', baseline['stages'], stages))
+        regressions.extend(find_regressions(
+            'file', baseline['sources'], sources))
+        for message in regressions:
+            print 'REGRESSION: %s' % message
+        if regressions:
+            return 1
+        print 'No regressions compared to %s' % FLAGS.baseline
+
     return 0
 
 
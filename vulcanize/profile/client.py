@@ -0,0 +1,172 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""HTTP load generator shared by the benchmarks."""
+
+import socket
+import threading
+import time
+
+from .. server import STALE_HEADER
+
+
+# Size of each read from the server's socket.
+RECV_BYTES = 64 * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    """Returns the count and percentiles of a list of latencies in seconds."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def get_url(host, port, url_path, request_headers=None):
+    """Sends an HTTP/1.0 GET request and reads the response.
+
+    Much cheaper than httplib, so the client takes less of the CPU away
+    from the server being measured.
+
+    Returns:
+        Tuple (status, headers, body) where the header names are lowercase.
+
+    Raises:
+        IOError if the connection fails, or ValueError if the response
+        can't be parsed.
+    """
+    lines = ['GET %s HTTP/1.0' % url_path]
+    for name, value in (request_headers or {}).iteritems():
+        lines.append('%s: %s' % (name, value))
+
+    connection = socket.create_connection((host, port))
+    try:
+        connection.sendall('\r\n'.join(lines) + '\r\n\r\n')
+        chunks = []
+        while True:
+            chunk = connection.recv(RECV_BYTES)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        connection.close()
+
+    head, _, body = ''.join(chunks).partition('\r\n\r\n')
+    status_line, _, header_lines = head.partition('\r\n')
+    status_parts = status_line.split(' ', 2)
+    if len(status_parts) < 2 or not status_line.startswith('HTTP/'):
+        raise ValueError('Bad status line %r for %r' % (status_line, url_path))
+    status = int(status_parts[1])
+    response_headers = {}
+    for line in header_lines.split('\r\n'):
+        name, _, value = line.partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, body
+
+
+def run_requests(host, port, pick_path, requests, concurrency,
+                 conditional=False):
+    """Sends requests to the server from several threads at once.
+
+    Args:
+        host: Host of the server.
+        port: Port of the server.
+        pick_path: Function that is given the index of a request and
+            returns a tuple (kind, url_path). Latencies are reported for
+            each kind of request. Called while holding a lock.
+        requests: Number of requests to send.
+        concurrency: Number of requests to send at the same time.
+        conditional: When True, the validators from earlier responses are
+            sent so unchanged files can be answered with 304 Not Modified.
+
+    Returns:
+        Dictionary with the throughput, counts of errors, 304s and stale
+        responses, and the summarized latencies of all requests and of each
+        kind of request.
+    """
+    lock = threading.Lock()
+    sent = [0]
+    latencies = {}
+    etags = {}
+    counts = {'errors': 0, 'not_modified': 0, 'stale': 0, 'bytes': 0}
+
+    def worker():
+        while True:
+            with lock:
+                if sent[0] == requests:
+                    return
+                kind, url_path = pick_path(sent[0])
+                sent[0] += 1
+                etag = etags.get(url_path)
+
+            request_headers = {}
+            if conditional and etag:
+                request_headers['If-None-Match'] = etag
+
+            start = time.time()
+            try:
+                status, response_headers, body = get_url(
+                    host, port, url_path, request_headers)
+            except (IOError, ValueError):
+                with lock:
+                    counts['errors'] += 1
+                continue
+            elapsed = time.time() - start
+
+            with lock:
+                latencies.setdefault(kind, []).append(elapsed)
+                counts['bytes'] += len(body)
+                if status == 304:
+                    counts['not_modified'] += 1
+                elif status != 200:
+                    counts['errors'] += 1
+                if STALE_HEADER.lower() in response_headers:
+                    counts['stale'] += 1
+                if response_headers.get('etag'):
+                    etags[url_path] = response_headers['etag']
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    all_latencies = []
+    for values in latencies.itervalues():
+        all_latencies.extend(values)
+
+    result = dict(counts)
+    result.update(summarize(all_latencies))
+    result.update({
+        'seconds': elapsed,
+        'requests_per_second': len(all_latencies) / elapsed,
+        'kinds': dict((kind, summarize(values))
+                      for kind, values in latencies.iteritems()),
+    })
+    return result
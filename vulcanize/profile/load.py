@@ -0,0 +1,234 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Load test for the vulcanize development server.
+
+Starts the server on a free local port, serving the current working directory,
+and sends a mix of bundle and static file requests from many threads at once.
+Source files can be touched during the run to force rebuilds. Prints the
+throughput, latency percentiles, errors and the number of builds the server
+ran as JSON, so runs with different server options can be compared.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+
+from .. cache import BackgroundBuilder, BundleCache, FileCache
+from .. server import STATS_PATH, Server, get_handler
+from . client import get_url, run_requests
+
+
+class Flags(object):
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description=__doc__,
+            prog='vulcanize.profile.load')
+        self.parser.add_argument(
+            '-v', '--verbose',
+            help='Do verbose logging.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '-n', '--requests',
+            help='Number of requests to send.',
+            action='store',
+            type=int,
+            default=1000)
+        self.parser.add_argument(
+            '-c', '--concurrency',
+            help='Number of requests to send at the same time.',
+            action='store',
+            type=int,
+            default=8)
+        self.parser.add_argument(
+            '--bundle-fraction',
+            help='Fraction of requests that are for bundles instead of '
+                 'static files.',
+            action='store',
+            type=float,
+            default=0.5)
+        self.parser.add_argument(
+            '--static',
+            help='Path of a static file to request, relative to the current '
+                 'directory. May be repeated.',
+            action='append',
+            default=[])
+        self.parser.add_argument(
+            '--touch',
+            help='Path of a source file to touch during the run to force '
+                 'rebuilds. May be repeated.',
+            action='append',
+            default=[])
+        self.parser.add_argument(
+            '--touch-interval',
+            help='Seconds between touching the next file given with --touch.',
+            action='store',
+            type=float,
+            default=0.5)
+        self.parser.add_argument(
+            '--conditional',
+            help='Send the validators from earlier responses so unchanged '
+                 'files can be answered with 304 Not Modified.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '--cache-mb',
+            help='Memory budget of the server cache in megabytes.',
+            action='store',
+            type=int,
+            default=32)
+        self.parser.add_argument(
+            '--wait-for-rebuild',
+            help='Run the server with requests waiting for rebuilds instead '
+                 'of getting the last good output.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            'bundles',
+            help='Paths of the HTML files to request as bundles, relative to '
+                 'the current directory. The first is served at /.',
+            nargs='+',
+            type=str)
+
+    def parse(self):
+        self.parser.parse_args(namespace=self)
+        for path in self.bundles + self.static + self.touch:
+            if not os.path.isfile(path):
+                self.parser.error('path %r does not exist' % path)
+        if not 0 <= self.bundle_fraction <= 1:
+            self.parser.error('--bundle-fraction must be between 0 and 1')
+        if self.bundle_fraction < 1 and not self.static:
+            self.parser.error('--static required unless --bundle-fraction '
+                              'is 1')
+
+
+FLAGS = Flags()
+
+
+def get_url_path(path):
+    return '/' + os.path.normpath(path).replace(os.sep, '/')
+
+
+def make_server():
+    root_dir = os.getcwd()
+    cache = BundleCache(root_dir, max_bytes=FLAGS.cache_mb * 1024 * 1024)
+    builder = BackgroundBuilder(cache, wait_for_rebuild=FLAGS.wait_for_rebuild)
+    builder.start(FLAGS.bundles)
+
+    class QuietHandler(get_handler(root_dir, FLAGS.bundles[0], builder,
+                                   FileCache())):
+
+        def log_message(self, *args):
+            pass
+
+    return Server(('localhost', 0), QuietHandler)
+
+
+def get_builds(host, port):
+    return json.loads(get_url(host, port, STATS_PATH)[2])['builds']
+
+
+def touch_files(stop):
+    """Touches the --touch files in turn until stop is set.
+
+    Returns:
+        List that the number of files touched is appended to when done.
+    """
+    touched = []
+
+    def worker():
+        count = 0
+        while not stop.wait(FLAGS.touch_interval):
+            os.utime(FLAGS.touch[count % len(FLAGS.touch)], None)
+            count += 1
+        touched.append(count)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    return thread, touched
+
+
+def run_load(host, port):
+    bundle_paths = ['/'] + [get_url_path(p) for p in FLAGS.bundles[1:]]
+    static_paths = [get_url_path(p) for p in FLAGS.static]
+    rng = random.Random(0)
+
+    def pick_path(index):
+        if rng.random() < FLAGS.bundle_fraction:
+            return 'bundle', rng.choice(bundle_paths)
+        return 'static', rng.choice(static_paths)
+
+    # Wait for the first builds so only the rebuilds during the run count.
+    for url_path in bundle_paths:
+        get_url(host, port, url_path)
+    builds_before = get_builds(host, port)
+
+    stop = threading.Event()
+    if FLAGS.touch:
+        toucher, touched = touch_files(stop)
+
+    result = run_requests(host, port, pick_path, FLAGS.requests,
+                          FLAGS.concurrency, conditional=FLAGS.conditional)
+
+    stop.set()
+    if FLAGS.touch:
+        toucher.join()
+
+    result.update(result.pop('kinds'))
+    result.update({
+        'mode': {
+            'cache_mb': FLAGS.cache_mb,
+            'concurrency': FLAGS.concurrency,
+            'conditional': FLAGS.conditional,
+            'bundle_fraction': FLAGS.bundle_fraction,
+            'wait_for_rebuild': FLAGS.wait_for_rebuild,
+        },
+        'builds': get_builds(host, port) - builds_before,
+        'touched': touched[0] if FLAGS.touch else 0,
+    })
+    return result
+
+
+def main():
+    FLAGS.parse()
+
+    if FLAGS.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    server = make_server()
+    host, port = server.server_address
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        result = run_load(host, port)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    print json.dumps(result, indent=2, separators=(',', ': '), sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark for serving static files from the vulcanize server.
+
+Compares the caching static file handler of the vulcanize server against the
+stock SimpleHTTPRequestHandler it used before. The current working directory
+is served and the given files are requested over and over. Each server runs
+in its own process so it doesn't compete with the client for the GIL.
+"""
+
+import SimpleHTTPServer
+import SocketServer
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+
+from .. cache import BackgroundBuilder, BundleCache, FileCache
+from .. server import Server, get_handler
+from . client import run_requests
+
+
+class Flags(object):
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description=__doc__,
+            prog='vulcanize.profile.static')
+        self.parser.add_argument(
+            '-v', '--verbose',
+            help='Do verbose logging.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            '-n', '--requests',
+            help='Number of requests to send to each server.',
+            action='store',
+            type=int,
+            default=2000)
+        self.parser.add_argument(
+            '-c', '--concurrency',
+            help='Number of requests to send at the same time.',
+            action='store',
+            type=int,
+            default=8)
+        self.parser.add_argument(
+            '--conditional',
+            help='Send the validators from earlier responses so unchanged '
+                 'files can be answered with 304 Not Modified.',
+            action='store_true',
+            default=False)
+        self.parser.add_argument(
+            'paths',
+            help='Paths of the files to request, relative to the current '
+                 'directory.',
+            nargs='+',
+            type=str)
+
+    def parse(self):
+        self.parser.parse_args(namespace=self)
+        for path in self.paths:
+            if not os.path.isfile(path):
+                self.parser.error('path %r does not exist' % path)
+
+
+FLAGS = Flags()
+
+
+class LegacyHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def make_legacy_server():
+    return SocketServer.TCPServer(('localhost', 0), LegacyHandler)
+
+
+def make_cached_server():
+    root_dir = os.getcwd()
+    builder = BackgroundBuilder(BundleCache(root_dir))
+    builder.start()
+
+    class CachedHandler(get_handler(root_dir, None, builder, FileCache())):
+
+        def log_message(self, *args):
+            pass
+
+    return Server(('localhost', 0), CachedHandler)
+
+
+def serve(make_server, addresses):
+    server = make_server()
+    addresses.put(server.server_address)
+    server.serve_forever()
+
+
+def get_child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark(name, make_server):
+    """Returns the load results, including the server's CPU time per request.
+
+    The client is usually the bottleneck for throughput, so the server's CPU
+    time is the better measure of how much work each request takes.
+    """
+    cpu_seconds = get_child_cpu_seconds()
+    addresses = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(make_server, addresses))
+    process.start()
+    try:
+        host, port = addresses.get()
+        url_paths = ['/' + path.replace(os.sep, '/') for path in FLAGS.paths]
+        result = run_requests(
+            host, port,
+            lambda index: ('static', url_paths[index % len(url_paths)]),
+            FLAGS.requests, FLAGS.concurrency,
+            conditional=FLAGS.conditional)
+    finally:
+        process.terminate()
+        process.join()
+
+    # The server's CPU time is only counted once its process is reaped.
+    cpu_seconds = get_child_cpu_seconds() - cpu_seconds
+    result['server_cpu_ms'] = cpu_seconds * 1000 / FLAGS.requests
+    return result
+
+
+def main():
+    FLAGS.parse()
+
+    if FLAGS.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    print '%-8s %10s %9s %9s %9s %12s %7s %7s' % (
+        'handler', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'cpu ms/req',
+        '304s', 'errors')
+    for name, make_server in (('legacy', make_legacy_server),
+                              ('cached', make_cached_server)):
+        result = benchmark(name, make_server)
+        print '%-8s %10.1f %9.2f %9.2f %9.2f %12.3f %7d %7d' % (
+            name, result['requests_per_second'], result['p50_ms'],
+            result['p95_ms'], result['p99_ms'], result['server_cpu_ms'],
+            result['not_modified'], result['errors'])
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,34 +14,288 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import Queue
 import SimpleHTTPServer
 import SocketServer
+import errno
+import json
 import logging
 import os
+import posixpath
+import shutil
 import signal
 import sys
 import threading
 import time
+import urllib
+import urlparse
 
-from . pipeline import vulcanize
+from . cache import (
+    BackgroundBuilder, BundleCache, FileCache, DEFAULT_MAX_BYTES)
+from . import headers
 
 
-def get_handler(root_dir, index_path):
+# Path that reports the cache counters as JSON.
+STATS_PATH = '/_vulcanize/stats'
+
+# Response header with the number of seconds the output has been out of date.
+STALE_HEADER = 'X-Vulcanize-Stale'
+
+# Buffer size for copying large files when sendfile isn't available.
+COPY_BUFFER_BYTES = 256 * 1024
+
+# Number of threads that serve connections.
+DEFAULT_THREADS = 16
+
+# Buffer for response headers and small bodies, so most responses go out in
+# a single send instead of one per header line.
+WRITE_BUFFER_BYTES = 16 * 1024
+
+
+def get_sendfile():
+    """Returns a sendfile(out_fd, in_fd, offset, count) function, or None.
+
+    Python 2 has no os.sendfile, so on Linux the C library's is called
+    through ctypes instead.
+    """
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None or not sys.platform.startswith('linux'):
+        return sendfile
+
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        c_sendfile = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                           ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    c_sendfile.restype = ctypes.c_ssize_t
+
+    def libc_sendfile(out_fd, in_fd, offset, count):
+        c_offset = ctypes.c_int64(offset)
+        sent = c_sendfile(out_fd, in_fd, ctypes.byref(c_offset), count)
+        if sent < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return sent
+
+    return libc_sendfile
+
+
+SENDFILE = get_sendfile()
+
+
+def get_handler(root_dir, index_path, builder, files):
     """Wraps the parameters for the server in a closure."""
 
     class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+        wbufsize = WRITE_BUFFER_BYTES
+
+        # True when answering a HEAD request, which gets no body.
+        head_only = False
+
         def do_GET(self):
-            if self.path == '/':
-                self.wfile.write(vulcanize(root_dir, index_path))
+            self.head_only = False
+            self.dispatch(SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET)
+
+        def do_HEAD(self):
+            self.head_only = True
+            self.dispatch(SimpleHTTPServer.SimpleHTTPRequestHandler.do_HEAD)
+
+        def dispatch(self, fallback):
+            """Serves the request, or calls fallback for the stock handler.
+
+            The stock handler lists directories and sends 404s.
+            """
+            url_path = urlparse.urlsplit(self.path).path
+            if url_path == STATS_PATH:
+                stats = builder.cache.stats()
+                stats['static'] = files.stats()
+                self.send_body('application/json',
+                               json.dumps(stats, sort_keys=True))
+                return
+
+            if url_path == '/':
+                path = index_path
+            else:
+                path = self.get_local_path(url_path)
+            if path is None:
+                return fallback(self)
+
+            if url_path == '/' or path.endswith('.html'):
+                if not os.path.isfile(path):
+                    return fallback(self)
+                self.send_bundle(path)
             else:
-                return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+                self.send_static(path, fallback)
+
+        def get_local_path(self, url_path):
+            """Returns the path under root_dir for the URL path, or None."""
+            relative_path = posixpath.normpath(urllib.unquote(url_path))
+            parts = [p for p in relative_path.split('/') if p]
+            if os.pardir in parts:
+                return None
+            return os.path.join(root_dir, *parts)
+
+        def send_bundle(self, entry_path):
+            try:
+                bundle, stale_seconds = builder.get(entry_path)
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+
+            etag = headers.format_etag(bundle.etag)
+            if self.send_not_modified(etag, bundle.last_modified):
+                return
+
+            self.send_body('text/html; charset=utf-8', bundle.output,
+                           etag=etag, last_modified=bundle.last_modified,
+                           stale_seconds=stale_seconds, links=bundle.links)
+
+        def send_static(self, path, fallback):
+            # FileCache stats the file anyway, so let it find missing files
+            # and directories instead of checking first.
+            try:
+                static_file = files.get(path)
+            except (IOError, OSError):
+                return fallback(self)
+
+            etag = headers.format_etag(static_file.etag)
+            if self.send_not_modified(etag, static_file.mtime):
+                return
+
+            content_type = self.guess_type(path)
+            if static_file.content is not None:
+                self.send_body(content_type, static_file.content,
+                               etag=etag, last_modified=static_file.mtime)
+                return
+
+            try:
+                handle = open(path, 'rb')
+            except IOError:
+                self.send_error(404, 'File not found')
+                return
+
+            with handle:
+                size = os.fstat(handle.fileno()).st_size
+                self.send_headers(content_type, size, etag=etag,
+                                  last_modified=static_file.mtime)
+                if not self.head_only:
+                    self.copy_file(handle, size)
+
+        def send_not_modified(self, etag, mtime):
+            """Sends a 304 and returns True if the client's copy is current."""
+            if not headers.is_not_modified(
+                    etag, mtime,
+                    if_none_match=self.headers.get('If-None-Match'),
+                    if_modified_since=self.headers.get('If-Modified-Since')):
+                return False
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return True
+
+        def send_headers(self, content_type, content_length, etag=None,
+                         last_modified=None, stale_seconds=None, links=()):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(content_length))
+            self.send_header('Cache-Control', 'no-cache')
+            if etag is not None:
+                self.send_header('ETag', etag)
+            if last_modified is not None:
+                self.send_header('Last-Modified',
+                                 headers.format_date(last_modified))
+            if stale_seconds is not None:
+                # A rebuild is in flight; this is the last good output.
+                self.send_header(STALE_HEADER, '%.3f' % stale_seconds)
+            if links:
+                self.send_header('Link', ', '.join(links))
+            self.end_headers()
+
+        def send_body(self, content_type, body, **kwargs):
+            self.send_headers(content_type, len(body), **kwargs)
+            if not self.head_only:
+                self.wfile.write(body)
+
+        def copy_file(self, handle, size):
+            if SENDFILE is None:
+                shutil.copyfileobj(handle, self.wfile, COPY_BUFFER_BYTES)
+                return
+
+            # Let the kernel copy the file straight to the socket.
+            self.wfile.flush()
+            offset = 0
+            while offset < size:
+                try:
+                    sent = SENDFILE(self.connection.fileno(), handle.fileno(),
+                                    offset, size - offset)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if not sent:
+                    break
+                offset += sent
 
     return Handler
 
 
-def run_server(host, port, root_dir, index_path):
-    handler = get_handler(root_dir, index_path)
-    server = SocketServer.TCPServer((host, port), handler)
+class Server(SocketServer.TCPServer):
+    """Serves connections on a fixed pool of threads.
+
+    Starting a thread for every connection costs more than serving a small
+    static file does.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class,
+                 threads=DEFAULT_THREADS):
+        SocketServer.TCPServer.__init__(self, server_address, handler_class)
+        self.connections = Queue.Queue()
+        self.threads = []
+        for _ in xrange(threads):
+            thread = threading.Thread(target=self.process_connections)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def process_request(self, request, client_address):
+        self.connections.put((request, client_address))
+
+    def process_connections(self):
+        while True:
+            connection = self.connections.get()
+            if connection is None:
+                return
+            request, client_address = connection
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        for _ in self.threads:
+            self.connections.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def run_server(host, port, root_dir, index_path, max_bytes=DEFAULT_MAX_BYTES,
+               prewarm_paths=(), wait_for_rebuild=False, **build_options):
+    cache = BundleCache(root_dir, max_bytes=max_bytes, **build_options)
+    builder = BackgroundBuilder(cache, wait_for_rebuild=wait_for_rebuild)
+    builder.start([index_path] + list(prewarm_paths))
+
+    handler = get_handler(root_dir, index_path, builder, FileCache())
+    server = Server((host, port), handler)
     host, port = server.server_address
     logging.info('Serving on %s:%d', host, port)
 
@@ -52,3 +306,4 @@ def run_server(host, port, root_dir, index_path):
     except KeyboardInterrupt:
         logging.info('Terminating')
         server.shutdown()
+        logging.info('Cache stats: %r', cache.stats())
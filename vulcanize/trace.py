@@ -0,0 +1,139 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Attributes the time and allocations of a build to stages and files."""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import gc
+import time
+
+
+class NullTracer(object):
+    """Tracer that records nothing. Used when a build isn't being profiled."""
+
+    @contextmanager
+    def span(self, stage, source=None):
+        yield
+
+
+NULL_TRACER = NullTracer()
+
+
+class SpanStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.self_seconds = 0.0
+        self.total_allocations = 0
+        self.self_allocations = 0
+
+
+class Tracer(object):
+    """Records the time and allocations spent in nested pipeline spans.
+
+    Each span is a stage of the pipeline, like 'parse' or 'serialize', and
+    optionally the source file it worked on. Self time and self allocations
+    leave out the nested spans.
+
+    Allocations are the net number of new objects tracked by the garbage
+    collector. Collection must be disabled while tracing for these to be
+    accurate; see Tracer.run.
+    """
+
+    def __init__(self):
+        # Map of the tuple of (stage, source) pairs from the outermost span
+        # to the innermost one, to its SpanStats.
+        self.stacks = defaultdict(SpanStats)
+        self.current = []
+
+    def run(self, function, *args, **kwargs):
+        """Calls the function with garbage collection disabled."""
+        gc.collect()
+        was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if was_enabled:
+                gc.enable()
+
+    @contextmanager
+    def span(self, stage, source=None):
+        # Children add their totals here so they can be left out of ours.
+        frame = [0.0, 0]
+        self.current.append(((stage, source), frame))
+        start_allocations = gc.get_count()[0]
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            allocations = gc.get_count()[0] - start_allocations
+
+            stack = tuple(key for key, _ in self.current)
+            self.current.pop()
+
+            stats = self.stacks[stack]
+            stats.count += 1
+            stats.total_seconds += seconds
+            stats.self_seconds += seconds - frame[0]
+            stats.total_allocations += allocations
+            stats.self_allocations += allocations - frame[1]
+
+            if self.current:
+                parent_frame = self.current[-1][1]
+                parent_frame[0] += seconds
+                parent_frame[1] += allocations
+
+    def by_stage(self):
+        """Returns a dictionary of stage name to its self time and
+        allocations summed over all of its spans."""
+        result = defaultdict(lambda: {'seconds': 0.0, 'allocations': 0})
+        for stack, stats in self.stacks.iteritems():
+            stage, _ = stack[-1]
+            result[stage]['seconds'] += stats.self_seconds
+            result[stage]['allocations'] += stats.self_allocations
+        return dict(result)
+
+    def by_source(self):
+        """Returns a dictionary of source file to the self time and
+        allocations of all spans that worked on it."""
+        result = defaultdict(lambda: {'seconds': 0.0, 'allocations': 0})
+        for stack, stats in self.stacks.iteritems():
+            _, source = stack[-1]
+            if source is None:
+                continue
+            result[source]['seconds'] += stats.self_seconds
+            result[source]['allocations'] += stats.self_allocations
+        return dict(result)
+
+    def collapsed_stacks(self):
+        """Yields lines in the collapsed stack format used by flamegraph.pl.
+
+        Values are self times in microseconds.
+        """
+        for stack, stats in sorted(self.stacks.iteritems()):
+            frames = []
+            for stage, source in stack:
+                if source is None:
+                    frames.append(stage)
+                else:
+                    frames.append('%s %s' % (stage, source))
+            yield '%s %d' % (
+                ';'.join(f.replace(';', ':') for f in frames),
+                int(stats.self_seconds * 1000000))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2.7
+#
+# Copyright 2014 Brett Slatkin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""WSGI middleware that serves vulcanized entry points from memory.
+
+Example:
+
+    from vulcanize.wsgi import VulcanizeMiddleware
+
+    app = VulcanizeMiddleware(app, 'static', {
+        '/': 'static/index.html',
+        '/admin': 'static/admin.html',
+    })
+"""
+
+from . cache import BundleCache, DEFAULT_MAX_BYTES
+from . import headers
+
+
+class VulcanizeMiddleware(object):
+    """Serves vulcanized bundles at the given paths and delegates the rest.
+
+    Args:
+        app: WSGI application to call for all other paths, or None to
+            respond with 404 Not Found.
+        root_dir: Path to the directory root for vulcanizing.
+        entry_points: Dictionary mapping URL paths to the index files that
+            should be vulcanized and served at those paths.
+        max_bytes: Memory budget for bundles kept between requests.
+        **build_options: Keyword arguments to pass to pipeline.build.
+    """
+
+    def __init__(self, app, root_dir, entry_points,
+                 max_bytes=DEFAULT_MAX_BYTES, **build_options):
+        self.app = app
+        self.entry_points = entry_points
+        self.cache = BundleCache(root_dir, max_bytes=max_bytes,
+                                 **build_options)
+
+    def __call__(self, environ, start_response):
+        index_path = self.entry_points.get(environ.get('PATH_INFO') or '/')
+        if index_path is None:
+            if self.app is not None:
+                return self.app(environ, start_response)
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not Found']
+
+        method = environ['REQUEST_METHOD']
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [
+                ('Allow', 'GET, HEAD'),
+                ('Content-Type', 'text/plain')])
+            return ['Method Not Allowed']
+
+        bundle = self.cache.get(index_path)
+        etag = headers.format_etag(bundle.etag)
+        response_headers = [
+            ('ETag', etag),
+            ('Last-Modified', headers.format_date(bundle.last_modified)),
+            # Always revalidate so edits show up on the next reload.
+            ('Cache-Control', 'no-cache'),
+        ]
+
+        if headers.is_not_modified(
+                etag, bundle.last_modified,
+                if_none_match=environ.get('HTTP_IF_NONE_MATCH'),
+                if_modified_since=environ.get('HTTP_IF_MODIFIED_SINCE')):
+            start_response('304 Not Modified', response_headers)
+            return []
+
+        response_headers.extend([
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(bundle.output))),
+        ])
+        if bundle.links:
+            response_headers.append(('Link', ', '.join(bundle.links)))
+        start_response('200 OK', response_headers)
+        if method == 'HEAD':
+            return []
+        return [bundle.output]